@@ -355,9 +355,9 @@ for filename in glob.glob('keiba_data/horse_ids_*.json'):
     except Exception as e:
         print(f"Error reading {filename}: {e}")
 
-# 重複のない馬IDリストをJSONファイルに書き出し
+# 重複のない馬IDリストをJSONファイルに書き出し（実行ごとに同じ順序になるように並べ替える）
 with open(output_file, 'w') as f:
-    json.dump(list(all_horse_ids), f)
+    json.dump(sorted(all_horse_ids), f)
 
 print(f"Merged {len(all_horse_ids)} unique horse IDs to {output_file}")
 EOL
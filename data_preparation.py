@@ -7,45 +7,154 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import re
+import hashlib
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from keiba_utils import write_csv
 
 # データ保存用のディレクトリを作成
 output_dir = 'preprocessed_data'
 os.makedirs(output_dir, exist_ok=True)
 
+# カテゴリ型で保持するレースデータの列
+CATEGORICAL_COLS = ['weather', 'track_condition', 'course_type', 'race_class']
+
+# CSV読み込み時に型を固定する列（型推測を省き、ファイルごとに型がぶれないようにする）
+# IDは英字を含むもの（海外馬など）があるため文字列で扱う。数値列は推測に任せ、ワーカー内で変換する
+CSV_COLUMN_TYPES = {
+    'race_id': pa.string(),
+    'horse_id': pa.string(),
+    '着順': pa.string(),
+    'タイム': pa.string(),
+    **{col: pa.dictionary(pa.int32(), pa.string()) for col in CATEGORICAL_COLS},
+}
+
+# CSVをParquetに変換したキャッシュの保存先（列の型の指定を変えたらバージョンを上げてキャッシュを作り直す）
+cache_dir = f'{output_dir}/.cache/csv'
+os.makedirs(cache_dir, exist_ok=True)
+CACHE_VERSION = 2
+
+def _to_parquet_cache(csv_path):
+    """CSVをParquetキャッシュに変換し、キャッシュのパスを返す（CSVが更新されていれば作り直す）"""
+    cache_name = csv_path.replace(os.sep, '__').replace('/', '__')
+    cache_path = f'{cache_dir}/{os.path.splitext(cache_name)[0]}.v{CACHE_VERSION}.parquet'
+    if not os.path.exists(cache_path) or os.path.getmtime(csv_path) > os.path.getmtime(cache_path):
+        # pyarrowのマルチスレッドCSVパーサーで読み込む（存在しない列の型指定は無視される）
+        convert_options = pa_csv.ConvertOptions(column_types=CSV_COLUMN_TYPES, strings_can_be_null=True)
+        table = pa_csv.read_csv(csv_path, convert_options=convert_options)
+        pq.write_table(table, cache_path, compression='zstd')
+    return cache_path
+
+# 文字列列はPythonオブジェクトの配列ではなく、pyarrowの連続したバッファで保持する
+ARROW_STRING_TYPES = {
+    pa.string(): pd.StringDtype('pyarrow'),
+    pa.large_string(): pd.StringDtype('pyarrow'),
+}
+
+def _read_csv(path):
+    """CSVファイルを1つ読み込む（並列読み込みのワーカー、2回目以降はParquetキャッシュから読み込む）"""
+    return pq.read_table(_to_parquet_cache(path)).to_pandas(types_mapper=ARROW_STRING_TYPES.get)
+
+def _load(glob_pat, reader=_read_csv):
+    """globに一致するファイルをスレッドプールで並列に読み込み、ファイル一覧とDataFrameのリストを返す"""
+    # pyarrowの読み込みはGILを解放するので、プロセスを起こさずにスレッドで並列化できる
+    files = glob.glob(glob_pat)
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        dfs = list(executor.map(reader, files))
+    return files, dfs
+
+# 前処理の入力ファイル（これらの更新日時が変わらなければ統合の結果をキャッシュから読み込む）
+INPUT_PATTERNS = [
+    'keiba_data/races_*.csv',
+    'horse_data/horse_info_*.csv',
+    'horse_data/horse_history_*.csv',
+    'horse_data/horse_training_*.csv',
+]
+
+def _input_key(func, args, kwargs):
+    """入力ファイルのパスと更新日時、関数の引数とソースコードからキャッシュキーを作る
+    （関数から呼び出している読み込み処理などを変更した場合は、CACHE_VERSIONを上げて作り直す）"""
+    files = sorted(f for pattern in INPUT_PATTERNS for f in glob.glob(pattern))
+    stamp = ''.join(f'{f}:{os.path.getmtime(f)}\n' for f in files) + f'v{CACHE_VERSION}\n'
+    stamp += inspect.getsource(func) + repr((args, sorted(kwargs.items())))
+    return hashlib.sha1(stamp.encode('utf-8')).hexdigest()[:16]
+
+def disk_cache(func):
+    """DataFrameのタプルを返す関数の結果を、入力ファイルの更新日時と関数の内容をキーにParquetでキャッシュするデコレーター
+    （引数はreprでキーに含めるので、DataFrameを受け取る関数には使わない）"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        prefix = f'{output_dir}/.cache/{func.__name__}_'
+        manifest_path = f'{prefix}{_input_key(func, args, kwargs)}.json'
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                paths = json.load(f)
+            print(f"{func.__name__}: 入力ファイルに変更がないため、キャッシュから読み込みます")
+            return tuple(
+                pq.read_table(path).to_pandas(types_mapper=ARROW_STRING_TYPES.get) if path else None
+                for path in paths
+            )
+        
+        result = func(*args, **kwargs)
+        
+        # 古いキャッシュを削除してから保存し、最後にマニフェストを書いてキャッシュを有効にする
+        for old_path in glob.glob(f'{prefix}*'):
+            os.remove(old_path)
+        key = os.path.splitext(os.path.basename(manifest_path))[0]
+        paths = []
+        for i, df in enumerate(result):
+            if df is None:
+                paths.append(None)
+                continue
+            path = f'{output_dir}/.cache/{key}_{i}.parquet'
+            df.to_parquet(path, compression='zstd')
+            paths.append(path)
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(paths, f)
+        return result
+    return wrapper
+
+@disk_cache
 def integrate_data():
     """収集したデータを統合する関数"""
     print("=== データの統合を開始 ===")
     
     # レースデータの統合
-    race_files = glob.glob('keiba_data/races_*.csv')
-    race_dfs = []
-    for file in race_files:
-        df = pd.read_csv(file, encoding='utf-8-sig')
-        # ファイル名から年を抽出して列として追加
-        year = file.split('races_')[1].split('_')[0]
-        df['file_year'] = year
-        race_dfs.append(df)
-
-    races_df = pd.concat(race_dfs, ignore_index=True)
+    # 型変換は行方向に独立しているので、読み込みと合わせてファイルごとに並列で行う
+    race_files, race_dfs = _load('keiba_data/races_*.csv', reader=_read_race_csv)
+
+    # ファイル名から年を抽出し、結合後にカテゴリ列としてまとめて追加
+    file_years = [file.split('races_')[1].split('_')[0] for file in race_files]
+    years = sorted(set(file_years))
+    year_codes = np.array([years.index(year) for year in file_years], dtype=np.int32)
+    lengths = [len(df) for df in race_dfs]
+
+    races_df = pd.concat(race_dfs, ignore_index=True, copy=False)
+    races_df['file_year'] = pd.Categorical.from_codes(np.repeat(year_codes, lengths), categories=years)
+    # ファイルごとにカテゴリが異なると結合時にobject型に戻るため、結合後にカテゴリ型へ揃える
+    for col in CATEGORICAL_COLS:
+        if col in races_df.columns:
+            races_df[col] = races_df[col].astype('category')
     print(f"レースデータ: {len(races_df)}行, {races_df.shape[1]}列")
 
     # 馬の基本情報の統合
-    horse_info_files = glob.glob('horse_data/horse_info_*.csv')
-    horse_info_dfs = [pd.read_csv(file, encoding='utf-8-sig') for file in horse_info_files]
-    horse_info_df = pd.concat(horse_info_dfs, ignore_index=True)
+    _, horse_info_dfs = _load('horse_data/horse_info_*.csv')
+    horse_info_df = pd.concat(horse_info_dfs, ignore_index=True, copy=False)
     print(f"馬情報データ: {len(horse_info_df)}行, {horse_info_df.shape[1]}列")
 
     # 馬の出走履歴の統合
-    horse_history_files = glob.glob('horse_data/horse_history_*.csv')
-    horse_history_dfs = [pd.read_csv(file, encoding='utf-8-sig') for file in horse_history_files]
-    horse_history_df = pd.concat(horse_history_dfs, ignore_index=True)
+    _, horse_history_dfs = _load('horse_data/horse_history_*.csv')
+    horse_history_df = pd.concat(horse_history_dfs, ignore_index=True, copy=False)
     print(f"出走履歴データ: {len(horse_history_df)}行, {horse_history_df.shape[1]}列")
 
     # 調教データの統合（存在する場合）
-    horse_training_files = glob.glob('horse_data/horse_training_*.csv')
-    if horse_training_files:
-        horse_training_dfs = [pd.read_csv(file, encoding='utf-8-sig') for file in horse_training_files]
-        horse_training_df = pd.concat(horse_training_dfs, ignore_index=True)
+    _, horse_training_dfs = _load('horse_data/horse_training_*.csv')
+    if horse_training_dfs:
+        horse_training_df = pd.concat(horse_training_dfs, ignore_index=True, copy=False)
         print(f"調教データ: {len(horse_training_df)}行, {horse_training_df.shape[1]}列")
     else:
         horse_training_df = None
@@ -60,19 +169,22 @@ def remove_duplicates(races_df, horse_info_df, horse_history_df, horse_training_
     print("=== 重複データの削除を開始 ===")
     
     # 重複レコードの削除
-    races_df_clean = races_df.drop_duplicates(subset=['race_id', 'horse_id'], keep='last')
+    races_df_clean = races_df[~races_df.duplicated(subset=['race_id', 'horse_id'], keep='last')]
     print(f"重複削除前のレースデータ: {len(races_df)}行, 重複削除後: {len(races_df_clean)}行")
     
     # 馬情報の重複削除（同じ馬IDで最新のデータを保持）
     if 'birth_date' in horse_info_df.columns:
-        horse_info_df_clean = horse_info_df.sort_values('birth_date', ascending=False).drop_duplicates(subset=['horse_id'], keep='first')
+        # 全列を並べ替えずに、birth_dateの1列だけをソートして残す行を決める
+        order = horse_info_df['birth_date'].sort_values(ascending=False).index
+        keep = order[~horse_info_df.loc[order, 'horse_id'].duplicated(keep='first').to_numpy()]
+        horse_info_df_clean = horse_info_df.loc[keep]
     else:
         horse_info_df_clean = horse_info_df.drop_duplicates(subset=['horse_id'], keep='last')
     print(f"重複削除前の馬情報データ: {len(horse_info_df)}行, 重複削除後: {len(horse_info_df_clean)}行")
     
     # 出走履歴の重複削除
     if horse_history_df is not None:
-        horse_history_df_clean = horse_history_df.drop_duplicates(subset=['horse_id', 'race_id'], keep='last')
+        horse_history_df_clean = horse_history_df[~horse_history_df.duplicated(subset=['horse_id', 'race_id'], keep='last')]
         print(f"重複削除前の出走履歴データ: {len(horse_history_df)}行, 重複削除後: {len(horse_history_df_clean)}行")
     else:
         horse_history_df_clean = None
@@ -80,7 +192,8 @@ def remove_duplicates(races_df, horse_info_df, horse_history_df, horse_training_
     # 調教データの重複削除（日付と馬IDの組み合わせで最新を保持）
     if horse_training_df is not None:
         if 'date' in horse_training_df.columns:
-            horse_training_df_clean = horse_training_df.sort_values('date', ascending=False).drop_duplicates(subset=['horse_id', 'date'], keep='first')
+            # dateはキーに含まれるので日付順の並べ替えは不要
+            horse_training_df_clean = horse_training_df[~horse_training_df.duplicated(subset=['horse_id', 'date'], keep='first')]
         else:
             horse_training_df_clean = horse_training_df.drop_duplicates()
         print(f"重複削除前の調教データ: {len(horse_training_df)}行, 重複削除後: {len(horse_training_df_clean)}行")
@@ -91,133 +204,157 @@ def remove_duplicates(races_df, horse_info_df, horse_history_df, horse_training_
     
     return races_df_clean, horse_info_df_clean, horse_history_df_clean, horse_training_df_clean
 
-def handle_missing_values(races_df):
-    """欠損値の処理と型変換"""
-    print("=== 欠損値の処理と型変換を開始 ===")
-    
-    # レースデータの欠損値確認
-    missing_values = races_df.isnull().sum()
-    print("レースデータの欠損値:")
-    print(missing_values[missing_values > 0])
+def convert_time_to_seconds(times):
+    """タイム（文字列フォーマット "1:23.4" など）の列をまとめて秒数に変換する"""
+    parts = times.astype('string[pyarrow]').str.split(':', n=1, expand=True)
+    minutes = pd.to_numeric(parts[0], errors='coerce')
+    if parts.shape[1] == 1:
+        # すべてのタイムが秒だけで記録されている場合
+        return minutes
+    seconds = pd.to_numeric(parts[1], errors='coerce')
+    # タイムが秒だけで記録されている行はそのまま秒数として扱う
+    return (minutes * 60 + seconds).where(parts[1].notna(), minutes)
+
+# 「2023年4月1日」形式の日付
+JAPANESE_DATE_PATTERN = r'(\d{4})年(\d{1,2})月(\d{1,2})日'
+
+def parse_japanese_date(dates):
+    """「2023年4月1日」形式の日付の列をまとめてdatetimeに変換する（形式に合わない値はNaT）"""
+    parts = dates.astype('string[pyarrow]').str.extract(JAPANESE_DATE_PATTERN)
+    year = pd.to_numeric(parts[0], errors='coerce')
+    month = pd.to_numeric(parts[1], errors='coerce')
+    day = pd.to_numeric(parts[2], errors='coerce')
+    valid = (year.notna() & month.between(1, 12) & day.between(1, 31)).fillna(False).to_numpy(dtype=bool)
+    
+    # 年・月・日の整数からnumpyの日付演算で直接datetime64を組み立てる
+    y = year.fillna(1970).to_numpy(dtype=np.int64)
+    m = month.fillna(1).to_numpy(dtype=np.int64)
+    d = day.fillna(1).to_numpy(dtype=np.int64)
+    result = (y - 1970).astype('datetime64[Y]') + (m - 1).astype('timedelta64[M]') + (d - 1).astype('timedelta64[D]')
+    result = np.where(valid, result, np.datetime64('NaT')).astype('datetime64[ns]')
+    return pd.Series(result, index=dates.index)
+
+def convert_race_columns(races_df):
+    """レースデータの列を分析用の型に変換する（ファイル単位でも結合後でも適用でき、変換済みの列は変換し直さない）"""
+    # 変換した列はまとめておき、最後に1回のassignでDataFrameに反映する
+    converted = {}
     
     # 日付データの型変換（race_dateが文字列形式の場合）
-    if 'race_date' in races_df.columns:
+    if 'race_date' in races_df.columns and not pd.api.types.is_datetime64_any_dtype(races_df['race_date']):
         try:
             # 日付フォーマットを検出して変換
             sample_date = races_df['race_date'].dropna().iloc[0]
             if '年' in str(sample_date) and '月' in str(sample_date) and '日' in str(sample_date):
                 # 「2023年4月1日」形式の場合
-                races_df['race_date'] = pd.to_datetime(races_df['race_date'], format='%Y年%m月%d日', errors='coerce')
+                converted['race_date'] = parse_japanese_date(races_df['race_date'])
             else:
                 # その他の形式の場合はpandasに推測させる
-                races_df['race_date'] = pd.to_datetime(races_df['race_date'], errors='coerce')
+                converted['race_date'] = pd.to_datetime(races_df['race_date'], errors='coerce')
         except:
             print("日付変換に失敗しました。形式を確認してください。")
     
-    # 数値データの型変換
+    # 数値データの型変換（メモリ使用量を抑えるため、値の範囲に合わせて小さい型に落とす）
     # 着順をint型に変換（競走除外や失格などは欠損値として扱う）
-    if '着順' in races_df.columns:
-        # 着順が数値以外の場合の処理（'除', '取', '失', '中', '降'などの特殊値）
-        def convert_rank(rank):
-            try:
-                return int(rank)
-            except:
-                return np.nan
-                
-        races_df['着順_数値'] = races_df['着順'].apply(convert_rank)
-    
-    # タイム（文字列フォーマット "1:23.4" など）を秒数に変換する関数
-    def convert_time_to_seconds(time_str):
-        if pd.isna(time_str):
-            return None
-        try:
-            if ':' in str(time_str):
-                minutes, seconds = str(time_str).split(':')
-                return float(minutes) * 60 + float(seconds)
-            else:
-                # タイムが秒だけで記録されている場合
-                return float(time_str)
-        except:
-            return None
+    if '着順' in races_df.columns and '着順_数値' not in races_df.columns:
+        # 着順が数値以外の場合（'除', '取', '失', '中', '降'などの特殊値）は欠損値になる
+        # 着順は最大18なので、欠損値を保持できるInt8で十分
+        converted['着順_数値'] = pd.to_numeric(races_df['着順'], errors='coerce').astype('Int8')
     
     # タイムを秒に変換
-    if 'タイム' in races_df.columns:
-        races_df['タイム_秒'] = races_df['タイム'].apply(convert_time_to_seconds)
+    if 'タイム' in races_df.columns and 'タイム_秒' not in races_df.columns:
+        converted['タイム_秒'] = convert_time_to_seconds(races_df['タイム']).astype('float32')
     
-    # 距離をint型に変換
+    # 距離をint型に変換（200〜3600mなのでInt16で十分）
     if 'distance' in races_df.columns:
-        races_df['distance'] = pd.to_numeric(races_df['distance'], errors='coerce')
+        converted['distance'] = pd.to_numeric(races_df['distance'], errors='coerce').astype('Int16')
     
-    # 重要なカテゴリカル変数の欠損値を「不明」で埋める
-    categorical_cols = ['weather', 'track_condition', 'course_type', 'race_class']
-    for col in categorical_cols:
-        if col in races_df.columns:
-            races_df[col] = races_df[col].fillna('不明')
-    
-    # 馬体重と馬体重変化の処理
+    # 馬体重と馬体重変化の処理（いずれもInt16の範囲に収まる）
     if '体重' in races_df.columns:
-        races_df['体重'] = pd.to_numeric(races_df['体重'], errors='coerce')
+        converted['体重'] = pd.to_numeric(races_df['体重'], errors='coerce').astype('Int16')
     
     if '体重変化' in races_df.columns:
-        races_df['体重変化'] = pd.to_numeric(races_df['体重変化'], errors='coerce')
+        converted['体重変化'] = pd.to_numeric(races_df['体重変化'], errors='coerce').astype('Int16')
+    
+    return races_df.assign(**converted)
+
+def _read_race_csv(path):
+    """レースデータのCSVを1つ読み込み、ワーカー内で型変換まで済ませる"""
+    return convert_race_columns(_read_csv(path))
+
+def handle_missing_values(races_df):
+    """欠損値の処理と型変換"""
+    print("=== 欠損値の処理と型変換を開始 ===")
+    
+    # レースデータの欠損値確認
+    missing_values = races_df.isnull().sum()
+    print("レースデータの欠損値:")
+    print(missing_values[missing_values > 0])
+    
+    # 型変換（integrate_dataでファイルごとに変換済みの列はそのまま）
+    races_df = convert_race_columns(races_df)
+    
+    # 重要なカテゴリカル変数の欠損値を「不明」で埋め、カテゴリ型に変換する
+    for col in CATEGORICAL_COLS:
+        if col in races_df.columns:
+            if isinstance(races_df[col].dtype, pd.CategoricalDtype):
+                if '不明' not in races_df[col].cat.categories:
+                    races_df[col] = races_df[col].cat.add_categories('不明')
+                races_df[col] = races_df[col].fillna('不明')
+            else:
+                races_df[col] = races_df[col].fillna('不明').astype('category')
     
     print("=== 欠損値の処理と型変換が完了 ===")
     
     return races_df
 
-def handle_outliers(races_df):
-    """外れ値の検出と処理"""
+def handle_outliers(races_df, plot=False):
+    """外れ値の検出と処理（plot=Trueの場合のみ分布図を保存する）"""
     print("=== 外れ値の検出と処理を開始 ===")
     
-    races_df_copy = races_df.copy()
+    # 各ステップの条件をマスクとして積み上げ、最後に1回だけ抽出する（途中でコピーを作らない）
+    mask = pd.Series(True, index=races_df.index)
     
     # タイムの外れ値を検出
-    if 'タイム_秒' in races_df_copy.columns:
+    if 'タイム_秒' in races_df.columns:
         # 距離別にタイムの分布を確認
-        if 'distance' in races_df_copy.columns:
-            plt.figure(figsize=(12, 8))
-            sns.boxplot(x='distance', y='タイム_秒', data=races_df_copy)
-            plt.title('距離別のタイム分布')
-            plt.xticks(rotation=90)
-            plt.savefig(f'{output_dir}/time_by_distance.png')
-            plt.close()
+        if 'distance' in races_df.columns:
+            if plot:
+                plt.figure(figsize=(12, 8))
+                sns.boxplot(x='distance', y='タイム_秒', data=races_df)
+                plt.title('距離別のタイム分布')
+                plt.xticks(rotation=90)
+                plt.savefig(f'{output_dir}/time_by_distance.png')
+                plt.close()
             
-            # 距離ごとに外れ値を処理
-            grouped = races_df_copy.groupby('distance')
-            clean_dfs = []
+            # 距離ごとに外れ値を処理（距離別の平均・標準偏差から一括でZ-scoreを計算）
+            grouped = races_df.groupby('distance')['タイム_秒']
+            group_size = grouped.transform('size')
+            z_scores = ((races_df['タイム_秒'] - grouped.transform('mean')) / grouped.transform('std')).abs()
+            # Z-scoreが3未満のデータのみを保持（統計処理には最低2つのデータが必要なので、1件だけの距離はそのまま残す）
+            time_mask = ((z_scores < 3) | (group_size < 2)).fillna(False).astype(bool)
             
-            for distance, group in grouped:
-                if len(group) < 2:  # 統計処理には最低2つのデータが必要
-                    clean_dfs.append(group)
-                    continue
-                    
-                # Z-scoreを計算
-                z_scores = np.abs((group['タイム_秒'] - group['タイム_秒'].mean()) / group['タイム_秒'].std())
-                # Z-scoreが3未満のデータのみを保持
-                clean_group = group[z_scores < 3]
-                clean_dfs.append(clean_group)
-            
-            races_df_clean = pd.concat(clean_dfs)
-            print(f"タイムの外れ値除去前: {len(races_df_copy)}行, 外れ値除去後: {len(races_df_clean)}行")
-            races_df_copy = races_df_clean.copy()
+            before = int(mask.sum())
+            mask &= time_mask
+            print(f"タイムの外れ値除去前: {before}行, 外れ値除去後: {int(mask.sum())}行")
     
     # 馬体重の外れ値を検出
-    if '体重' in races_df_copy.columns:
-        plt.figure(figsize=(10, 6))
-        sns.histplot(races_df_copy['体重'].dropna(), bins=50)
-        plt.title('馬体重の分布')
-        plt.savefig(f'{output_dir}/weight_distribution.png')
-        plt.close()
+    if '体重' in races_df.columns:
+        if plot:
+            plt.figure(figsize=(10, 6))
+            sns.histplot(races_df.loc[mask, '体重'].dropna(), bins=50)
+            plt.title('馬体重の分布')
+            plt.savefig(f'{output_dir}/weight_distribution.png')
+            plt.close()
         
         # 極端な体重値を除外（例: 300kg未満や700kg超は誤記の可能性）
-        weight_mask = (races_df_copy['体重'] >= 300) & (races_df_copy['体重'] <= 700)
-        races_df_clean = races_df_copy[weight_mask | races_df_copy['体重'].isna()]
-        print(f"体重の外れ値除去前: {len(races_df_copy)}行, 外れ値除去後: {len(races_df_clean)}行")
-        races_df_copy = races_df_clean.copy()
+        weight_mask = ((races_df['体重'] >= 300) & (races_df['体重'] <= 700)) | races_df['体重'].isna()
+        before = int(mask.sum())
+        mask &= weight_mask.fillna(False).astype(bool)
+        print(f"体重の外れ値除去前: {before}行, 外れ値除去後: {int(mask.sum())}行")
     
     print("=== 外れ値の検出と処理が完了 ===")
     
-    return races_df_copy
+    return races_df.loc[mask]
 
 def main():
     """メイン実行関数"""
@@ -237,14 +374,14 @@ def main():
     
     # 前処理されたデータを保存
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    races_df_clean.to_csv(f'{output_dir}/cleaned_races_{timestamp}.csv', index=False, encoding='utf-8-sig')
-    horse_info_df.to_csv(f'{output_dir}/cleaned_horse_info_{timestamp}.csv', index=False, encoding='utf-8-sig')
+    write_csv(races_df_clean, f'{output_dir}/cleaned_races_{timestamp}.csv')
+    write_csv(horse_info_df, f'{output_dir}/cleaned_horse_info_{timestamp}.csv')
     
     if horse_history_df is not None:
-        horse_history_df.to_csv(f'{output_dir}/cleaned_horse_history_{timestamp}.csv', index=False, encoding='utf-8-sig')
+        write_csv(horse_history_df, f'{output_dir}/cleaned_horse_history_{timestamp}.csv')
     
     if horse_training_df is not None:
-        horse_training_df.to_csv(f'{output_dir}/cleaned_horse_training_{timestamp}.csv', index=False, encoding='utf-8-sig')
+        write_csv(horse_training_df, f'{output_dir}/cleaned_horse_training_{timestamp}.csv')
     
     print(f"前処理済みデータを {output_dir} ディレクトリに保存しました。")
     print(f"タイムスタンプ: {timestamp}")
@@ -1,16 +1,30 @@
 import requests
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 import pandas as pd
 import time
 import random
 import logging
 import json
 import os
+import hashlib
 from datetime import datetime
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import argparse
 import re
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from keiba_utils import cells_to_dataframe, write_csv
+
+# JSONの書き出しには、インストールされていれば高速なorjsonを使う（なければ標準のjson）
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # ロギングの設定
 logging.basicConfig(
@@ -30,20 +44,91 @@ logger.addHandler(console)
 OUTPUT_DIR = 'keiba_data'
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# デバッグ用ディレクトリ
+# デバッグ用ディレクトリ（取得したHTMLの保存は --debug または KEIBA_DEBUG_HTML=1 の場合のみ）
 DEBUG_DIR = f"{OUTPUT_DIR}/debug_html"
-os.makedirs(DEBUG_DIR, exist_ok=True)
+DEBUG_HTML = os.environ.get("KEIBA_DEBUG_HTML") == "1"
+if DEBUG_HTML:
+    os.makedirs(DEBUG_DIR, exist_ok=True)
+
+# リクエスト間隔の制御（--rate指定時に使用、スレッド間で共有する）
+class RateLimiter:
+    """
+    1秒あたりrate回を上限に、リクエストを一定間隔で送るように待機させる
+    
+    サーバーから429/503が返された場合は送信間隔を倍にし、成功するたびに少しずつ
+    指定の間隔まで戻す（加算増加・乗算減少）
+    """
+    
+    # 減速時の下限（指定した頻度に対する割合）と、成功時に戻す量
+    MIN_RATE_RATIO = 1 / 16
+    RECOVERY_RATIO = 1 / 10
+    
+    def __init__(self, rate):
+        self.base_rate = rate
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+    
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + 1.0 / self.rate
+        if wait_time > 0:
+            time.sleep(wait_time)
+    
+    def slow_down(self):
+        with self.lock:
+            self.rate = max(self.rate / 2, self.base_rate * self.MIN_RATE_RATIO)
+            rate = self.rate
+        logger.warning(f"Server is throttling requests, slowing down to {rate:.3f} requests/s")
+    
+    def speed_up(self):
+        with self.lock:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * self.RECOVERY_RATIO)
+
+# Noneの場合は間隔を制御しない（バッチ間の待機でサーバー負荷を抑える）
+_RATE_LIMITER = None
+
+# 混雑を示すステータスコード（リトライ途中で返されたものも含めて確認する）
+THROTTLE_STATUS_CODES = {429, 503}
+
+class RateLimitedSession(requests.Session):
+    """_RATE_LIMITERが設定されている場合、各リクエストの前に待機し、サーバーの混雑に応じて間隔を調整するセッション"""
+    
+    def request(self, *args, **kwargs):
+        limiter = _RATE_LIMITER
+        if limiter is None:
+            return super().request(*args, **kwargs)
+        
+        limiter.wait()
+        try:
+            response = super().request(*args, **kwargs)
+        except requests.exceptions.RetryError:
+            # リトライ回数を使い切った（429/503が続いた）場合
+            limiter.slow_down()
+            raise
+        
+        retries = getattr(response.raw, 'retries', None)
+        statuses = {history.status for history in retries.history} if retries is not None else set()
+        statuses.add(response.status_code)
+        if statuses & THROTTLE_STATUS_CODES:
+            limiter.slow_down()
+        else:
+            limiter.speed_up()
+        return response
 
 # セッション管理とリトライ処理の設定
 def create_session():
     """リトライ機能付きのセッションを作成"""
-    session = requests.Session()
+    session = RateLimitedSession()
     retry_strategy = Retry(
         total=5,
         backoff_factor=1,
         status_forcelist=[429, 500, 502, 503, 504]
     )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
+    # 同じホストへの接続を使い回せるようにコネクションプールを確保する
+    adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=retry_strategy)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     
@@ -64,6 +149,115 @@ def create_session():
     
     return session
 
+# すべてのリクエストで共有するセッション（get_session()で初回に作成）
+_SESSION = None
+
+def get_session():
+    """共有セッションを返す（keep-aliveで接続を使い回すため、セッションは1つだけ作る）"""
+    global _SESSION
+    if _SESSION is None:
+        _SESSION = create_session()
+    return _SESSION
+
+# HTMLの解析用ヘルパー（ページはlxmlで1回だけ解析し、すべての抽出処理で同じツリーを使う）
+# CSSセレクタはコンパイル済みのXPathに対応させておき、渡した要素の子孫を検索する
+def _has_class(class_name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')"
+
+SELECTOR_XPATHS = {
+    selector: etree.XPath(xpath) for selector, xpath in {
+        '#page_title h1': ".//*[@id='page_title']//h1",
+        'table': ".//table",
+        'th': ".//th",
+        'tr': ".//tr",
+        'td': ".//td",
+        'table.race_table_01': f".//table[{_has_class('race_table_01')}]",
+        'table.Shutuba_table': f".//table[{_has_class('Shutuba_table')}]",
+        'div.race_result_table table': f".//div[{_has_class('race_result_table')}]//table",
+        '#contents_liquid table': ".//*[@id='contents_liquid']//table",
+        'table.race_table_01 td.horsename a, table.Shutuba_table td.horsename a': (
+            f".//table[{_has_class('race_table_01')} or {_has_class('Shutuba_table')}]//td[{_has_class('horsename')}]//a"
+        ),
+        'a[href*="/horse/"]': ".//a[contains(@href, '/horse/')]",
+        'td[nowrap=nowrap]:not([class])': ".//td[@nowrap='nowrap' and not(@class)]",
+        'td.txt_c[nowrap=nowrap]': f".//td[@nowrap='nowrap' and {_has_class('txt_c')}]",
+        'span.F03': f".//span[{_has_class('F03')}]",
+        'span.Popularity': f".//span[{_has_class('Popularity')}]",
+    }.items()
+}
+
+# クラス属性を持つすべての要素（タグを限定しないクラスの検索はページ全体の走査になるため、1回の走査で索引を作る）
+CLASS_ELEMENTS_XPATH = etree.XPath(".//*[@class]")
+
+def class_index(root):
+    """クラス名から、そのクラスを持つ要素のリスト（文書順）への対応を作る"""
+    index = {}
+    for elem in CLASS_ELEMENTS_XPATH(root):
+        for class_name in elem.get('class').split():
+            index.setdefault(class_name, []).append(elem)
+    return index
+
+def with_class(classes, class_name, tag=None, within=None):
+    """
+    class_indexの索引から、クラスを持つ要素を文書順で返す
+    
+    Args:
+        tag: 指定した場合、そのタグの要素だけを返す
+        within: 指定した場合、このクラスを持つ要素の子孫だけを返す
+    """
+    elems = classes.get(class_name, [])
+    if tag is not None:
+        elems = [elem for elem in elems if elem.tag == tag]
+    if within is not None:
+        containers = set(classes.get(within, []))
+        elems = [elem for elem in elems if any(ancestor in containers for ancestor in elem.iterancestors())]
+    return elems
+
+# 天候・馬場状態の候補になるspan
+CONDITION_SPAN_XPATH = etree.XPath(".//span[contains(., '天候') or contains(., '芝') or contains(., 'ダート')]")
+
+# 要素内のテキスト（scriptとstyleの中身は除く）
+TEXT_XPATH = etree.XPath(".//text()[not(parent::script or parent::style)]")
+
+def select(elem, selector):
+    """セレクタに一致する要素をすべて返す"""
+    return SELECTOR_XPATHS[selector](elem)
+
+def select_one(elem, selector):
+    """セレクタに一致する最初の要素を返す（見つからない場合はNone）"""
+    elems = SELECTOR_XPATHS[selector](elem)
+    return elems[0] if elems else None
+
+def get_text(elem):
+    """要素内のテキストを、前後の空白を除いて連結する（BeautifulSoupのget_text(strip=True)と同じ）"""
+    return ''.join(text.strip() for text in TEXT_XPATH(elem))
+
+def header_index(table):
+    """テーブルの見出し（th）の文字列から列番号への対応を作る（見出し内の空白は除き、同じ見出しは最初の列を使う）"""
+    index = {}
+    for i, th in enumerate(select(table, 'th')):
+        index.setdefault(WHITESPACE_RE.sub('', ''.join(TEXT_XPATH(th))), i)
+    return index
+
+# EUC-JPのページをバイト列のまま解析するパーサー（パーサーはスレッド間で共有できないためスレッドごとに作る）
+_PARSER_LOCAL = threading.local()
+
+def parse_euc_jp(content):
+    """
+    EUC-JPのページ（バイト列）を解析してルート要素を返す
+    
+    文字コードの変換はlibxml2に任せるが、不正なバイト列があるとそこで解析が打ち切られるため、
+    その場合だけ不正なバイトを無視してデコードした文字列で解析し直す
+    """
+    parser = getattr(_PARSER_LOCAL, 'parser', None)
+    if parser is None:
+        parser = _PARSER_LOCAL.parser = lxml.html.HTMLParser(encoding='euc-jp')
+    
+    root = lxml.html.document_fromstring(content, parser=parser)
+    if any(error.type_name == 'ERR_INVALID_ENCODING' for error in parser.error_log):
+        root = lxml.html.document_fromstring(content.decode("euc-jp", "ignore"))
+    return root
+
 # 場所コードと名前のマッピング
 PLACE_DICT = {
     '01': '札幌', '02': '函館', '03': '福島', '04': '新潟',
@@ -71,52 +265,211 @@ PLACE_DICT = {
     '09': '阪神', '10': '小倉'
 }
 
+# レースが存在しない場合のページに含まれるメッセージ（ページはEUC-JPで返される）
+NO_RACE_MARKERS = tuple(text.encode('euc-jp') for text in ("レース情報がありません", "存在しないレースID"))
+NO_RACE_MARKER_MAX_LEN = max(len(marker) for marker in NO_RACE_MARKERS)
+
+# レースの存在確認で本文を読み込む単位（存在しないレースのページはメッセージが見つかった時点で読み込みをやめる）
+PROBE_CHUNK_SIZE = 8192
+
+# レース結果テーブルと行の検出用パターン（ページ全体を解析せずにバイト列を走査する）
+RACE_TABLE_RE = re.compile(rb'<table\b[^>]*\bclass\s*=\s*["\'][^"\']*\brace_table_01\b', re.IGNORECASE)
+TABLE_END_RE = re.compile(rb'</table\s*>', re.IGNORECASE)
+TABLE_ROW_RE = re.compile(rb'<tr[\s>]', re.IGNORECASE)
+
 # レースの有効性をより厳格にチェック
-def is_valid_race(race_id, session=None):
+def is_valid_race(race_id, session=None, pages=None):
     """
     レースIDが有効かどうかをチェックする
     
     Args:
         race_id: チェックするレースID
         session: リクエストセッション
+        pages: 指定した場合、有効なレースのページ（zlib圧縮したバイト列）をレースIDをキーに格納する辞書
     
     Returns:
-        bool: レースが存在する場合はTrue
+        bool: レースが存在する場合はTrue（通信エラーなどで判定できなかった場合はNone）
     """
-    if session is None:
-        session = create_session()
+    session = session or get_session()
     
     url = f"https://db.netkeiba.com/race/{race_id}"
     
     try:
-        # GETリクエストで確実に取得
-        response = session.get(url)
-        html_content = response.content.decode("euc-jp", "ignore")
+        # GETリクエストで確実に取得（エラー時は本文を読まずに接続を返す）
+        response = session.get(url, stream=True)
+        if response.status_code != 200:
+            response.close()
+            return None
         
-        # レースが存在しない場合のメッセージをチェック
-        if "レース情報がありません" in html_content or "存在しないレースID" in html_content:
-            return False
-            
-        # レース結果テーブルの存在を確認（より厳密なチェック）
-        soup = BeautifulSoup(html_content, 'html.parser')
-        race_table = soup.select_one('table.race_table_01')
+        # 本文を少しずつ読み込み、レースが存在しない場合のメッセージをデコードせずにバイト列のままチェック
+        buffer = bytearray()
+        for chunk in response.iter_content(PROBE_CHUNK_SIZE):
+            start = max(0, len(buffer) - NO_RACE_MARKER_MAX_LEN)
+            buffer += chunk
+            if any(buffer.find(marker, start) >= 0 for marker in NO_RACE_MARKERS):
+                response.close()
+                return False
+        content = bytes(buffer)
         
-        # 有効なレースには常にテーブルが存在する
-        if not race_table:
+        # レース結果テーブルの存在を確認（有効なレースには常にテーブルが存在する）
+        table_match = RACE_TABLE_RE.search(content)
+        if not table_match:
             return False
         
-        # テーブルの中身が空でないことを確認
-        rows = race_table.find_all('tr')
-        if len(rows) <= 1:  # ヘッダー行のみの場合
+        # テーブルの中身が空でないことを確認（ヘッダー行のみの場合は無効）
+        table_end = TABLE_END_RE.search(content, table_match.end())
+        rows = TABLE_ROW_RE.findall(content, table_match.start(), table_end.start() if table_end else len(content))
+        if len(rows) <= 1:
             return False
+        
+        # 結果の取得時に再ダウンロードしないようにページを保持する
+        if pages is not None:
+            pages[race_id] = zlib.compress(content, 1)
             
         return True
     except Exception as e:
         logger.error(f"Error checking race {race_id}: {str(e)}")
-        return False
+        return None
+
+# レースの存在確認を並列に行う数（サーバー負荷を考慮して控えめにする）
+PROBE_WORKERS = 8
+
+# 開催日やレース番号を先頭から続けて確認する際に、1つの並びでまとめて確認する数
+# （存在しないレースが見つかった並びはそこで確認をやめるので、無駄な問い合わせはこの数より少なくなる）
+PROBE_WAVE_SIZE = 4
+
+# 開催回・開催日・レース番号用の2桁ゼロ埋め文字列（TWO_DIGITS[n] == f"{n:02d}"）
+TWO_DIGITS = [f"{i:02d}" for i in range(13)]
+
+# レース結果の取得を並列に行う最大数（実際の同時取得数はバッチサイズまで）
+SCRAPE_WORKERS = 8
+
+# レースの存在確認結果の保存先（再実行時にサーバーへ問い合わせ直さないようにする）
+PROBE_CACHE_DB = f"{OUTPUT_DIR}/probe_cache.sqlite"
+# 今年以降のレースで「存在しない」と判定した結果を使う期間（秒）（開催前のレースは後で追加されるため）
+PROBE_CACHE_NEGATIVE_TTL = 24 * 60 * 60
+
+def open_probe_cache():
+    """レースの存在確認結果を保存するSQLiteデータベースを開く"""
+    conn = sqlite3.connect(PROBE_CACHE_DB)
+    conn.execute("CREATE TABLE IF NOT EXISTS probe(race_id TEXT PRIMARY KEY, is_valid INTEGER NOT NULL, checked_at INTEGER NOT NULL)")
+    # 存在確認で取得したページ（結果の取得で使うまでメモリに溜めずに保存しておく）
+    conn.execute("CREATE TABLE IF NOT EXISTS page(race_id TEXT PRIMARY KEY, content BLOB NOT NULL)")
+    return conn
+
+def load_probe_results(conn, race_ids):
+    """
+    保存済みの存在確認結果のうち、まだ使えるものを返す
+    
+    Returns:
+        dict: レースID -> 存在確認結果（bool）
+    """
+    now = int(time.time())
+    current_year = datetime.now().year
+    placeholders = ','.join('?' * len(race_ids))
+    results = {}
+    for race_id, is_valid, checked_at in conn.execute(
+            f"SELECT race_id, is_valid, checked_at FROM probe WHERE race_id IN ({placeholders})", race_ids):
+        # 過去の年のレースと存在するレースの結果は変わらない
+        if is_valid or int(race_id[:4]) < current_year or now - checked_at < PROBE_CACHE_NEGATIVE_TTL:
+            results[race_id] = bool(is_valid)
+    return results
+
+def save_probe_results(conn, results):
+    """存在確認結果（レースID -> bool）を保存する"""
+    now = int(time.time())
+    conn.executemany("INSERT OR REPLACE INTO probe(race_id, is_valid, checked_at) VALUES(?, ?, ?)",
+                     [(race_id, int(is_valid), now) for race_id, is_valid in results.items()])
+    conn.commit()
+
+def save_probed_pages(conn, pages):
+    """存在確認で取得したページ（レースID -> zlib圧縮したバイト列）を保存する"""
+    conn.executemany("INSERT OR REPLACE INTO page(race_id, content) VALUES(?, ?)", list(pages.items()))
+    conn.commit()
+
+def load_probed_pages(conn, race_ids):
+    """
+    保存済みのページを返す
+    
+    Returns:
+        dict: レースID -> zlib圧縮したページ（保存されていないレースIDは含まない）
+    """
+    placeholders = ','.join('?' * len(race_ids))
+    return dict(conn.execute(f"SELECT race_id, content FROM page WHERE race_id IN ({placeholders})", race_ids))
+
+def delete_probed_pages(conn, race_ids):
+    """使い終わった（または使わない）レースIDのページを削除する"""
+    conn.executemany("DELETE FROM page WHERE race_id = ?", [(race_id,) for race_id in race_ids])
+    conn.commit()
+
+def probe_races(race_ids, session, executor, cache=None, keep_pages=False):
+    """
+    複数のレースIDの存在確認を並列に行う
+    
+    Args:
+        race_ids: チェックするレースIDのリスト
+        session: リクエストセッション
+        executor: 確認に使うスレッドプール
+        cache: 存在確認結果を保存するデータベース（保存済みのレースIDは問い合わせない）
+        keep_pages: Trueの場合、有効なレースのページをcacheに保存する（結果の取得時に再ダウンロードしない）
+    
+    Returns:
+        list: race_idsと同じ順序の存在確認結果（bool、判定できなかった場合はNone）
+    """
+    known = load_probe_results(cache, race_ids) if cache is not None else {}
+    unknown_ids = [race_id for race_id in race_ids if race_id not in known]
+    # ページはこの呼び出しで確認した分だけメモリに置き、すぐにデータベースへ書き出す
+    pages = {} if keep_pages and cache is not None else None
+    checked = dict(zip(unknown_ids, executor.map(lambda race_id: is_valid_race(race_id, session, pages), unknown_ids)))
+    
+    # 判定できなかったものは保存せず、次回に確認し直す
+    if cache is not None:
+        save_probe_results(cache, {race_id: is_valid for race_id, is_valid in checked.items() if is_valid is not None})
+        if pages:
+            save_probed_pages(cache, pages)
+    
+    known.update(checked)
+    return [known[race_id] for race_id in race_ids]
+
+def count_leading_valid(results):
+    """先頭から連続して存在するレースの数を返す（最初に存在しないレース以降は存在しないとみなす）"""
+    count = 0
+    for is_valid in results:
+        if not is_valid:
+            break
+        count += 1
+    return count
+
+def probe_leading_valid(sequences, session, executor, cache=None, keep_pages=False):
+    """
+    レースIDの並びごとに、先頭から連続して存在するレースの数を調べる
+    各並びの続きをPROBE_WAVE_SIZE件ずつ、すべての並びの分をまとめて並列に確認し、
+    存在しないレースが見つかった並びはそれ以降を確認しない
+    
+    Args:
+        sequences: レースIDのリストのリスト
+        session, executor, cache, keep_pages: probe_racesを参照
+    
+    Returns:
+        list: 並びごとの、先頭から連続して存在するレースの数
+    """
+    counts = [0] * len(sequences)
+    pending = [i for i, race_ids in enumerate(sequences) if race_ids]
+    while pending:
+        waves = [(i, sequences[i][counts[i]:counts[i] + PROBE_WAVE_SIZE]) for i in pending]
+        results = probe_races([race_id for _, race_ids in waves for race_id in race_ids], session, executor, cache, keep_pages)
+        pending = []
+        offset = 0
+        for i, race_ids in waves:
+            count = count_leading_valid(results[offset:offset + len(race_ids)])
+            offset += len(race_ids)
+            counts[i] += count
+            if count == len(race_ids) and counts[i] < len(sequences[i]):
+                pending.append(i)
+    return counts
 
 # 効率的なレースIDの生成と検証
-def generate_race_ids_efficiently(year, places=None):
+def generate_race_ids_efficiently(year, places=None, keep_pages=False):
     """
     効率的にレースIDを生成して処理する関数
     以下のルールに基づいて最適化:
@@ -124,9 +477,12 @@ def generate_race_ids_efficiently(year, places=None):
     2. ある開催日の1Rがない → 次の開催回の開催1日目へスキップ
     3. あるレースがない → その日の残りのレースも全てないとみなす
     
+    開催日の1Rやその日の2R～12RはPROBE_WAVE_SIZE件ずつ並列に確認し、存在しないレースが見つかったらそれ以降は確認しない
+    
     Args:
         year: 対象年
         places: 対象競馬場コードのリスト（Noneの場合はすべての競馬場）
+        keep_pages: Trueの場合、存在確認で取得したページを存在確認結果のデータベースに保存する（load_probed_pagesで取り出す）
     
     Returns:
         list: 処理すべき有効なレースIDのリスト
@@ -139,91 +495,109 @@ def generate_race_ids_efficiently(year, places=None):
     
     logger.info(f"Generating race IDs for {year} with places: {', '.join([PLACE_DICT.get(p, p) for p in places])}")
     
-    # セッションを作成（レースの存在確認に使用）
-    session = create_session()
-    
-    for place_code in places:
-        place_name = PLACE_DICT.get(place_code, '不明')
-        logger.info(f"Starting to process {place_name}({place_code}) races")
+    # 共有セッションを使用（レースの存在確認に使用）
+    session = get_session()
+    # 以前の実行で確認済みのレースはサーバーに問い合わせない
+    with closing(open_probe_cache()) as probe_cache, ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+        for place_code in places:
+            place_name = PLACE_DICT.get(place_code, '不明')
+            logger.info(f"Starting to process {place_name}({place_code}) races")
 
-        # 各開催回（1~6回）
-        for kai in range(1, 7):
-            # 開催1日目の1Rをチェック（開催回の存在確認）
-            first_day_first_race = f"{year_str}{place_code}{str(kai).zfill(2)}0101"
-            
-            # 開催1日目の1Rが存在するか確認
-            if not is_valid_race(first_day_first_race, session):
-                logger.info(f"First race of meeting {kai} at {place_name} not found")
-                # 重要: この開催回が存在しない場合、以降の開催回も全て存在しないとみなす
-                logger.info(f"No more meetings at {place_name} for this year")
-                break  # この競馬場でのループを終了
-            
-            # 開催1日目の1Rが存在する場合、その日のレースを全て処理
-            logger.info(f"First race of meeting {kai} day 1 found, processing meeting {kai}")
-            valid_race_ids.append(first_day_first_race)
-            
-            # 開催1日目の2R～12Rを処理
-            for race_num in range(2, 13):
-                race_id = f"{year_str}{place_code}{str(kai).zfill(2)}01{str(race_num).zfill(2)}"
-                # レースの有効性をチェック
-                if not is_valid_race(race_id, session):
-                    logger.info(f"Race {race_num} of day 1 in meeting {kai} not found, skipping to next day")
-                    break  # 同じ日の次のレースへのループを終了し、次の日へ
-                valid_race_ids.append(race_id)
-            
-            # 開催2日目～12日目を処理
-            for day in range(2, 13):
-                # 各開催日の1Rをチェック（開催日の存在確認）
-                first_race_of_day = f"{year_str}{place_code}{str(kai).zfill(2)}{str(day).zfill(2)}01"
+            # 各開催回（1~6回）
+            for kai in range(1, 7):
+                # 年・競馬場・開催回までのIDの接頭辞
+                kai_prefix = f"{year_str}{place_code}{TWO_DIGITS[kai]}"
+                
+                # 開催1日目の1Rをチェック（開催回の存在確認）
+                first_day_first_race = f"{kai_prefix}0101"
+                if not probe_races([first_day_first_race], session, executor, probe_cache, keep_pages)[0]:
+                    logger.info(f"First race of meeting {kai} at {place_name} not found")
+                    # 重要: この開催回が存在しない場合、以降の開催回も全て存在しないとみなす
+                    logger.info(f"No more meetings at {place_name} for this year")
+                    break  # この競馬場でのループを終了
                 
-                # 開催日の1Rが存在するか確認
-                if not is_valid_race(first_race_of_day, session):
-                    logger.info(f"First race of day {day} in meeting {kai} not found, skipping to next meeting")
-                    break  # 次の開催回へスキップ（重要な修正点）
+                logger.info(f"First race of meeting {kai} day 1 found, processing meeting {kai}")
                 
-                # 開催日の1Rが存在する場合、その日のレースを全て処理
-                logger.info(f"First race of day {day} in meeting {kai} found, processing all races for this day")
-                valid_race_ids.append(first_race_of_day)
+                # 開催2日目～12日目の1Rを数日分ずつまとめて確認（開催日の存在確認）
+                later_days = list(range(2, 13))
+                later_first_races = [f"{kai_prefix}{TWO_DIGITS[day]}01" for day in later_days]
+                day_count = probe_leading_valid([later_first_races], session, executor, probe_cache, keep_pages)[0]
+                if day_count < len(later_days):
+                    logger.info(f"First race of day {later_days[day_count]} in meeting {kai} not found, skipping to next meeting")
+                days = [1] + later_days[:day_count]
                 
-                # 2R～12Rを処理
-                for race_num in range(2, 13):
-                    race_id = f"{year_str}{place_code}{str(kai).zfill(2)}{str(day).zfill(2)}{str(race_num).zfill(2)}"
-                    # レースの有効性をチェック
-                    if not is_valid_race(race_id, session):
-                        logger.info(f"Race {race_num} of day {day} in meeting {kai} not found, skipping to next day")
-                        break  # 同じ日の次のレースへのループを終了し、次の日へ
-                    valid_race_ids.append(race_id)
+                # 存在する開催日の2R～12Rを、すべての開催日の分をまとめて数レースずつ確認
+                day_race_ids = [
+                    [f"{kai_prefix}{TWO_DIGITS[day]}{TWO_DIGITS[race_num]}" for race_num in range(1, 13)]
+                    for day in days
+                ]
+                race_counts = probe_leading_valid([race_ids[1:] for race_ids in day_race_ids], session, executor, probe_cache, keep_pages)
+                
+                for day, race_ids, race_count in zip(days, day_race_ids, race_counts):
+                    if day > 1:
+                        logger.info(f"First race of day {day} in meeting {kai} found, processing all races for this day")
+                    valid_race_ids.append(race_ids[0])
+                    
+                    if race_count < 11:
+                        logger.info(f"Race {race_count + 2} of day {day} in meeting {kai} not found, skipping to next day")
+                    valid_race_ids.extend(race_ids[1:race_count + 1])
                     
     logger.info(f"Generated {len(valid_race_ids)} valid race IDs to process")
     return valid_race_ids
 
+# 収集した馬IDの保存先（年ごとに重複なく蓄積し、中断後の再開時にも引き継ぐ）
+HORSE_ID_DB = f"{OUTPUT_DIR}/horse_ids.sqlite"
+
+def open_horse_id_db():
+    """馬ID保存用のSQLiteデータベースを開く"""
+    conn = sqlite3.connect(HORSE_ID_DB)
+    conn.execute("CREATE TABLE IF NOT EXISTS horse_id(id TEXT NOT NULL, year INTEGER NOT NULL, PRIMARY KEY(id, year))")
+    return conn
+
+def load_horse_ids(conn, year):
+    """指定年に収集済みの馬IDをリストで返す"""
+    return [row[0] for row in conn.execute("SELECT id FROM horse_id WHERE year = ? ORDER BY id", (year,))]
+
 # レース結果ページをスクレイピング
-def scrape_race_results(race_id, session=None):
-    """レース結果をスクレイピングする関数"""
-    if session is None:
-        session = create_session()
+def scrape_race_results(race_id, session=None, page=None):
+    """
+    レース結果をスクレイピングする関数
+    
+    pageに存在確認で取得済みのページ（zlib圧縮したバイト列）を渡した場合は再ダウンロードしない
+    """
+    session = session or get_session()
     
     url = f"https://db.netkeiba.com/race/{race_id}"
-    logger.info(f"Requesting: {url}")
     
     try:
-        response = session.get(url)
-        
-        if response.status_code != 200:
-            logger.error(f"Error: Status code {response.status_code} for {url}")
-            return None, {}
-        
-        # 明示的にデコードして処理
-        html_content = response.content.decode("euc-jp", "ignore")
-        
-        # レスポンスのHTMLをファイルに保存（デバッグ用）
-        with open(f"{DEBUG_DIR}/race_{race_id}.html", 'w', encoding='utf-8') as f:
-            f.write(html_content)
+        if page is not None:
+            logger.info(f"Using page fetched during race check: {url}")
+            content = zlib.decompress(page)
+        else:
+            logger.info(f"Requesting: {url}")
+            response = session.get(url, stream=True)
+            
+            if response.status_code != 200:
+                logger.error(f"Error: Status code {response.status_code} for {url}")
+                response.close()
+                return None, {}
+            content = response.content
+
+            # レースが存在しないページは解析せずに終了（バイト列のままメッセージを確認）
+            if any(marker in content for marker in NO_RACE_MARKERS):
+                logger.warning(f"No race found for {race_id}")
+                return None, {}
+
+        # レスポンスのHTMLを受信したバイト列のまま保存（デバッグ用、ページのcharset指定どおりEUC-JPで開ける）
+        if DEBUG_HTML:
+            with open(f"{DEBUG_DIR}/race_{race_id}.html", 'wb') as f:
+                f.write(content)
         
-        soup = BeautifulSoup(html_content, 'html.parser')
+        # バイト列のまま解析（デコードはlibxml2で行う）
+        root = parse_euc_jp(content)
         
         # レースの基本情報を取得
-        race_info = extract_race_info(soup, race_id)
+        race_info = extract_race_info(root, race_id)
         
         # レース結果テーブルを取得（複数のセレクタを試す）
         table = None
@@ -235,35 +609,32 @@ def scrape_race_results(race_id, session=None):
         ]
         
         for selector in selectors:
-            table = soup.select_one(selector)
-            if table:
+            table = select_one(root, selector)
+            if table is not None:
                 logger.info(f"Found race table with selector: {selector}")
                 break
         
-        if not table:
+        if table is None:
             # HTMLを詳細に分析してテーブルを探す
-            all_tables = soup.find_all('table')
+            all_tables = select(root, 'table')
             if all_tables:
                 logger.info(f"Found {len(all_tables)} tables on the page, trying to identify the right one")
                 # テーブルの構造を確認し、レース結果テーブルを特定
                 for i, tbl in enumerate(all_tables):
-                    headers = [th.text.strip() for th in tbl.find_all('th')]
-                    if '着順' in ' '.join(headers) or '馬名' in ' '.join(headers):
+                    headers = header_index(tbl)
+                    if '着順' in headers or '馬名' in headers:
                         table = tbl
                         logger.info(f"Identified race table by headers")
                         break
             
-            if not table:
+            if table is None:
                 logger.warning(f"No race table found for {race_id}")
                 return None, race_info
         
-        # pandasでテーブルを解析
+        # 解析済みのテーブルから直接DataFrameを作成
         try:
-            dfs = pd.read_html(str(table))
-            if dfs:
-                # 最初のテーブルを取得
-                df = dfs[0]
-                
+            df = table_to_dataframe(table, text_columns=list(HORSE_DETAIL_SOURCE_COLUMNS.values()) + [HORSE_WEIGHT_COLUMN])
+            if df is not None:
                 # 列名をクリーンアップ（スペースの除去）
                 df.columns = [col.strip() if isinstance(col, str) else col for col in df.columns]
                 
@@ -272,35 +643,33 @@ def scrape_race_results(race_id, session=None):
                     logger.warning(f"The table doesn't seem to be a race result table: {df.columns}")
                     return None, race_info
                 
+                # 追加する列はまとめておき、最後に一度だけDataFrameに反映する
+                new_columns = {}
+                
                 # レースIDを列として追加
-                df['race_id'] = race_id
+                new_columns['race_id'] = race_id
                 
                 # 馬IDを抽出
-                horse_ids = extract_horse_ids(soup)
+                horse_ids = extract_horse_ids(root)
                 if horse_ids and len(horse_ids) == len(df):
-                    df['horse_id'] = horse_ids
-                
-                # 通過順、体重、体重変化、上がり、人気を追加
-                passage_orders, weights, weight_diffs, last_3f, popularities = extract_horse_details(soup, len(df))
-                
-                if passage_orders and len(passage_orders) == len(df):
-                    df['通過順'] = passage_orders
+                    new_columns['horse_id'] = horse_ids
                 
-                if weights and len(weights) == len(df):
-                    df['体重'] = weights
+                # 通過順、体重、体重変化、上がり、人気を結果テーブルの列から追加
+                details = horse_details_from_table(df)
                 
-                if weight_diffs and len(weight_diffs) == len(df):
-                    df['体重変化'] = weight_diffs
+                # テーブルに列がない項目だけHTMLから抽出する
+                if len(details) < len(HORSE_DETAIL_COLUMNS):
+                    extracted = dict(zip(HORSE_DETAIL_COLUMNS, extract_horse_details(root, table, len(df))))
+                    for col, values in extracted.items():
+                        if col not in details and values and len(values) == len(df):
+                            details[col] = values
                 
-                if last_3f and len(last_3f) == len(df):
-                    df['上がり'] = last_3f
+                for col in HORSE_DETAIL_COLUMNS:
+                    if col in details:
+                        new_columns[col] = details[col]
                 
-                if popularities and len(popularities) == len(df):
-                    df['人気'] = popularities
-                
-                # レース基本情報をデータフレームの各行に追加
-                for key, value in race_info.items():
-                    df[key] = value
+                # レース基本情報（天候と馬場状態を含む）をデータフレームの各行に追加
+                new_columns.update(race_info)
                 
                 # レースIDから基本情報を追加
                 try:
@@ -313,25 +682,17 @@ def scrape_race_results(race_id, session=None):
                     # 場所名
                     place_name = PLACE_DICT.get(place_code, '不明')
                     
-                    df['place_code'] = place_code
-                    df['place_name'] = place_name
-                    df['kai'] = kai
-                    df['day'] = day
-                    df['race_number'] = race_num
+                    new_columns.update(place_code=place_code, place_name=place_name,
+                                       kai=kai, day=day, race_number=race_num)
                 except:
                     pass
                 
-                # 天候と馬場状態が明示的に含まれていることを確認
-                if 'weather' in race_info:
-                    df['weather'] = race_info['weather']
-                if 'track_condition' in race_info:
-                    df['track_condition'] = race_info['track_condition']
+                df = df.assign(**new_columns)
                 
-                # データフレームに天候と馬場情報が確実に含まれるようにする（最終チェック）
-                if 'weather' not in df.columns and 'weather' in race_info:
-                    df['weather'] = race_info['weather']
-                if 'track_condition' not in df.columns and 'track_condition' in race_info:
-                    df['track_condition'] = race_info['track_condition']
+                # 詳細情報の列にそのまま写した元の列（通過、上り）は重複になるので保存しない
+                duplicated_columns = [source_col for detail_col, source_col in HORSE_DETAIL_SOURCE_COLUMNS.items()
+                                      if source_col != detail_col and source_col in df.columns]
+                df = df.drop(columns=duplicated_columns)
                 
                 logger.info(f"Successfully scraped race {race_id}")
                 return df, race_info
@@ -346,9 +707,66 @@ def scrape_race_results(race_id, session=None):
         logger.error(f"Exception while scraping {url}: {str(e)}")
         return None, {}
 
-# 馬の詳細情報（通過順、体重、上がり、人気）を抽出
-def extract_horse_details(soup, expected_horses):
-    """レース結果ページから馬の詳細情報を抽出"""
+# テーブルの行を直接DataFrameにする
+WHITESPACE_RE = re.compile(r'\s+')
+
+def table_to_dataframe(table, text_columns=()):
+    """
+    lxmlのテーブル要素からDataFrameを作成する
+    （pd.read_htmlと同様にセル内の空白を詰め、数値への変換はcells_to_dataframeで行う）
+    
+    Args:
+        table: テーブル要素
+        text_columns: 数値型に変換せず文字列のまま残す列名
+    
+    Returns:
+        DataFrame: テーブルの内容（ヘッダー行またはデータ行がない場合はNone）
+    """
+    headers = None
+    rows = []
+    for tr in select(table, 'tr'):
+        cells = [WHITESPACE_RE.sub(' ', cell.text_content().strip()) for cell in tr.xpath('./th|./td')]
+        if headers is None:
+            if tr.find('th') is not None:
+                headers = cells
+            continue
+        if tr.find('td') is not None:
+            rows.append(cells)
+    
+    return cells_to_dataframe(headers, rows, text_columns)
+
+# 結果テーブルの列名と、追加する詳細情報の列名の対応
+HORSE_DETAIL_SOURCE_COLUMNS = {'通過順': '通過', '上がり': '上り', '人気': '人気'}
+HORSE_WEIGHT_COLUMN = '馬体重'
+HORSE_DETAIL_COLUMNS = ['通過順', '体重', '体重変化', '上がり', '人気']
+# 「480(+2)」形式の馬体重（計不などは一致しない）
+HORSE_WEIGHT_PATTERN = r'^(?P<体重>\d+)(?:\((?P<体重変化>[+-]?\d+)\))?$'
+HORSE_WEIGHT_RE = re.compile(HORSE_WEIGHT_PATTERN)
+
+# 結果テーブルの列から馬の詳細情報（通過順、体重、上がり、人気）を取り出す
+def horse_details_from_table(df):
+    """
+    結果テーブルのDataFrameから通過順、体重、体重変化、上がり、人気を列単位で取り出す
+    
+    Returns:
+        dict: 詳細情報の列名 -> Series（テーブルに元の列がない項目は含まない）
+    """
+    details = {}
+    for detail_col, source_col in HORSE_DETAIL_SOURCE_COLUMNS.items():
+        if source_col in df.columns:
+            details[detail_col] = df[source_col].fillna('')
+    
+    if HORSE_WEIGHT_COLUMN in df.columns:
+        weight_parts = df[HORSE_WEIGHT_COLUMN].astype('string').str.extract(HORSE_WEIGHT_PATTERN)
+        # 計不などで読み取れない場合は従来どおり0とする
+        details['体重'] = pd.to_numeric(weight_parts['体重']).fillna(0).astype('int64')
+        details['体重変化'] = pd.to_numeric(weight_parts['体重変化']).fillna(0).astype('int64')
+    
+    return details
+
+# 馬の詳細情報（通過順、体重、上がり、人気）をHTMLから抽出（結果テーブルに列がない場合の予備）
+def extract_horse_details(root, table, expected_horses):
+    """レース結果ページから馬の詳細情報を抽出（tableはscrape_race_resultsで見つけた結果テーブル）"""
     try:
         passage_orders = []
         weights = []
@@ -357,73 +775,41 @@ def extract_horse_details(soup, expected_horses):
         popularities = []
         
         # 通過順の抽出
-        nowrap_cells = soup.find_all("td", nowrap="nowrap", class_=None)
-        for i in range(0, len(nowrap_cells), 3):  # 3つごとに処理
-            if i+1 < len(nowrap_cells):
-                # 通過順
-                try:
-                    passage_order = nowrap_cells[i].get_text(strip=True)
-                    passage_orders.append(passage_order)
-                except:
-                    passage_orders.append('')
-                
-                # 体重と体重変化
-                try:
-                    weight_text = nowrap_cells[i+1].get_text(strip=True)
-                    if '(' in weight_text and ')' in weight_text:
-                        weight = int(weight_text.split('(')[0])
-                        weight_diff = int(weight_text.split('(')[1].split(')')[0])
-                    else:
-                        weight = int(weight_text) if weight_text.isdigit() else 0
-                        weight_diff = 0
-                        
-                    weights.append(weight)
-                    weight_diffs.append(weight_diff)
-                except:
-                    weights.append(0)
-                    weight_diffs.append(0)
+        nowrap_cells = select(root, 'td[nowrap=nowrap]:not([class])')
+        for i in range(0, len(nowrap_cells) - 1, 3):  # 3つごとに処理
+            # 通過順
+            passage_orders.append(get_text(nowrap_cells[i]))
+            
+            # 体重と体重変化（「480(+2)」形式以外は0）
+            weight_match = HORSE_WEIGHT_RE.match(get_text(nowrap_cells[i+1]))
+            if weight_match:
+                weights.append(int(weight_match.group('体重')))
+                weight_diffs.append(int(weight_match.group('体重変化') or 0))
+            else:
+                weights.append(0)
+                weight_diffs.append(0)
         
         # 上がりタイムと人気の抽出
-        txt_c_cells = soup.find_all("td", nowrap="nowrap", class_="txt_c")
+        txt_c_cells = select(root, 'td.txt_c[nowrap=nowrap]')
         
         # 上がりタイム（3F）
-        last_3f_cells = [cell for cell in txt_c_cells if cell.find('span', class_='F03')]
-        for cell in last_3f_cells:
-            try:
-                last_time = cell.find('span', class_='F03').get_text(strip=True)
-                last_3f.append(last_time)
-            except:
-                last_3f.append('')
+        for cell in txt_c_cells:
+            last_3f_span = select_one(cell, 'span.F03')
+            if last_3f_span is not None:
+                last_3f.append(get_text(last_3f_span))
         
         # 人気
-        popularity_spans = soup.find_all("span", class_="Popularity")
-        for span in popularity_spans:
-            try:
-                popularity = span.get_text(strip=True)
-                popularities.append(popularity)
-            except:
-                popularities.append('')
+        popularity_spans = select(root, 'span.Popularity')
+        popularities = [get_text(span) for span in popularity_spans]
         
         # 別の方法でも試す場合
         if not popularity_spans:
-            try:
-                pop_index = -1
-                for i, col in enumerate(soup.find_all('th')):
-                    if '人気' in col.get_text():
-                        pop_index = i
-                        break
-                
-                if pop_index >= 0:
-                    rows = soup.find('table', class_='race_table_01').find_all('tr')[1:]  # ヘッダー行をスキップ
-                    popularities = []
-                    for row in rows:
-                        cells = row.find_all('td')
-                        if pop_index < len(cells):
-                            popularities.append(cells[pop_index].get_text(strip=True))
-                        else:
-                            popularities.append('')
-            except:
-                pass
+            # 結果テーブルはページから探し直さず、見つけ済みのものを使う
+            pop_index = header_index(table).get('人気', -1)
+            if pop_index >= 0:
+                for row in select(table, 'tr')[1:]:  # ヘッダー行をスキップ
+                    cells = select(row, 'td')
+                    popularities.append(get_text(cells[pop_index]) if pop_index < len(cells) else '')
         
         # 結果のリストサイズをチェックして調整
         while len(passage_orders) < expected_horses:
@@ -443,28 +829,37 @@ def extract_horse_details(soup, expected_horses):
         logger.error(f"Error extracting horse details: {str(e)}")
         return [], [], [], [], []
 
+# レース情報の抽出に使う正規表現（呼び出しごとにコンパイルしないようにモジュールで1回だけコンパイル）
+WEATHER_RE = re.compile(r'天候\s*[:：]\s*(\S+)')
+TRACK_RE = re.compile(r'(芝|ダート)\s*[:：]\s*(\S+)')
+DIST_RE = re.compile(r'(\d+)m')
+COURSE_DIST_RE = re.compile(r'(芝|ダート)(\d+)m')
+# レースのクラスを示す文字列
+RACE_GRADES = ('G1', 'G2', 'G3', 'G', 'オープン', '新馬', '未勝利')
+
 # レース情報を抽出
-def extract_race_info(soup, race_id):
-    """HTMLからレース情報を抽出する"""
+def extract_race_info(root, race_id):
+    """lxmlで解析したHTMLからレース情報を抽出する"""
     race_info = {'race_id': race_id}
     
+    # クラス名による検索は、ページを1回だけ走査して作った索引から引く
+    classes = class_index(root)
+    
     # レース名
-    race_name_elem = soup.select_one('.data_intro h1')
-    if race_name_elem:
-        race_info['race_name'] = race_name_elem.get_text(strip=True)
+    race_name_elem = next((h1 for intro in with_class(classes, 'data_intro') for h1 in intro.iterdescendants('h1')), None)
+    if race_name_elem is not None:
+        race_info['race_name'] = get_text(race_name_elem)
     else:
-        # 代替セレクタを試す
-        alt_selectors = ['.race_title', 'h1.tit', '#page_title h1']
-        for selector in alt_selectors:
-            elem = soup.select_one(selector)
-            if elem:
-                race_info['race_name'] = elem.get_text(strip=True)
-                break
+        # 代替セレクタを試す（.race_title, h1.tit, #page_title h1）
+        alt_elems = with_class(classes, 'race_title') or with_class(classes, 'tit', tag='h1') or select(root, '#page_title h1')
+        if alt_elems:
+            race_info['race_name'] = get_text(alt_elems[0])
     
     # 日付・場所・コンディション等
-    race_details_elem = soup.select_one('.data_intro .smalltxt')
-    if race_details_elem:
-        race_details = race_details_elem.get_text(strip=True)
+    race_details_elems = with_class(classes, 'smalltxt', within='data_intro')
+    if race_details_elems:
+        race_details_elem = race_details_elems[0]
+        race_details = get_text(race_details_elem)
         race_info['race_details'] = race_details
         
         # 日付を抽出
@@ -473,12 +868,12 @@ def extract_race_info(soup, race_id):
             if race_date_parts:
                 race_info['race_date'] = race_date_parts[0] + '日'
     else:
-        # 代替セレクタを試す
-        alt_selectors = ['.race_data', '.race_header_data', '.RaceData01', 'p.smalltxt']
-        for selector in alt_selectors:
-            elem = soup.select_one(selector)
-            if elem:
-                race_details = elem.get_text(strip=True)
+        # 代替セレクタを試す（.race_data, .race_header_data, .RaceData01, p.smalltxt）
+        alt_selectors = [('race_data', None), ('race_header_data', None), ('RaceData01', None), ('smalltxt', 'p')]
+        for class_name, tag in alt_selectors:
+            elems = with_class(classes, class_name, tag=tag)
+            if elems:
+                race_details = get_text(elems[0])
                 race_info['race_details'] = race_details
                 
                 # 日付を抽出
@@ -489,48 +884,45 @@ def extract_race_info(soup, race_id):
                 break
     
     # 直接RaceData01クラスから天候と馬場情報を抽出（修正版）
-    race_data_elem = soup.select_one('.RaceData01')
-    if race_data_elem:
-        race_data_text = race_data_elem.get_text(strip=True)
+    race_data_elems = with_class(classes, 'RaceData01')
+    if race_data_elems:
+        race_data_text = get_text(race_data_elems[0])
         
         # 天候の抽出 - 正規表現パターンを修正
-        weather_match = re.search(r'天候\s*[:：]\s*(\S+)', race_data_text)
+        weather_match = WEATHER_RE.search(race_data_text)
         if weather_match:
             race_info['weather'] = weather_match.group(1)
         
         # 馬場状態の抽出 - 正規表現パターンを修正
-        track_match = re.search(r'(芝|ダート)\s*[:：]\s*(\S+)', race_data_text)
+        track_match = TRACK_RE.search(race_data_text)
         if track_match:
             race_info['track_condition'] = track_match.group(2)
     
     # バックアップの抽出方法: すべてのspanタグをチェック
+    # （天候・馬場状態のキーワードを含まないspanは正規表現に一致しないので、XPathの段階で除外する）
     if 'weather' not in race_info or 'track_condition' not in race_info:
-        span_elements = soup.find_all('span')
+        span_elements = CONDITION_SPAN_XPATH(root)
         for span in span_elements:
-            span_text = span.get_text(strip=True)
+            span_text = get_text(span)
             
             # 天候と馬場状態をチェック
             if 'weather' not in race_info:
-                weather_match = re.search(r'天候\s*[:：]\s*(\S+)', span_text)
+                weather_match = WEATHER_RE.search(span_text)
                 if weather_match:
                     race_info['weather'] = weather_match.group(1)
             
             # 馬場状態 - コース種別に続く状態を検索
             if 'track_condition' not in race_info:
-                track_match = re.search(r'(芝|ダート)\s*[:：]\s*(\S+)', span_text)
+                track_match = TRACK_RE.search(span_text)
                 if track_match:
                     race_info['track_condition'] = track_match.group(2)
     
     # より詳細なレース情報（クラス、コース種別、距離、馬場状態など）を抽出
     try:
         # レースの詳細情報は複数の場所に存在する可能性があるので複数のセレクタを試す
-        race_data_spans = []
-        selectors = ['span.race_type', 'span.Icon_GradeType', 'div.data_intro span']
-        
-        for selector in selectors:
-            spans = soup.select(selector)
-            if spans:
-                race_data_spans.extend(spans)
+        # （span.race_type, span.Icon_GradeType, div.data_intro span の順）
+        race_data_spans = with_class(classes, 'race_type', tag='span') + with_class(classes, 'Icon_GradeType', tag='span')
+        race_data_spans.extend(span for intro in with_class(classes, 'data_intro', tag='div') for span in intro.iterdescendants('span'))
         
         race_class = ''
         course_type = ''
@@ -541,10 +933,10 @@ def extract_race_info(soup, race_id):
         
         # 各spanからレース情報を抽出する
         for span in race_data_spans:
-            span_text = span.get_text(strip=True)
+            span_text = get_text(span)
             
             # レースのクラス（G1, G2, G3, 新馬, 未勝利など）
-            if any(grade in span_text for grade in ['G1', 'G2', 'G3', 'G', 'オープン', '新馬', '未勝利']):
+            if any(grade in span_text for grade in RACE_GRADES):
                 race_class = span_text
             
             # コース情報を含むスパン
@@ -556,7 +948,7 @@ def extract_race_info(soup, race_id):
                     course_type = 'ダート'
                 
                 # 距離（メートル単位）
-                distance_match = re.search(r'(\d+)m', span_text)
+                distance_match = DIST_RE.search(span_text)
                 if distance_match:
                     distance = distance_match.group(1)
                 
@@ -593,20 +985,23 @@ def extract_race_info(soup, race_id):
         if weather and 'weather' not in race_info:
             race_info['weather'] = weather
         
-        # 別の方法でも詳細情報を取得する
+        # 別の方法でも詳細情報を取得する（足りない項目を補うだけなので、すべて揃っている場合は探さない）
         race_data_text = ''
-        race_data_selectors = ['.RaceData', '.RaceList_Item', '.race_data_info', 'div.data_intro', '.RaceData01']
+        race_data_selectors = [('RaceData', None), ('RaceList_Item', None), ('race_data_info', None), ('data_intro', 'div'), ('RaceData01', None)]
+        has_all_details = (race_info.get('course_type') and race_info.get('distance')
+                           and 'track_condition' in race_info and 'weather' in race_info)
         
-        for selector in race_data_selectors:
-            race_data_elem = soup.select_one(selector)
-            if race_data_elem:
-                race_data_text = race_data_elem.get_text(strip=True)
-                break
+        if not has_all_details:
+            for class_name, tag in race_data_selectors:
+                elems = with_class(classes, class_name, tag=tag)
+                if elems:
+                    race_data_text = get_text(elems[0])
+                    break
         
         if race_data_text:
             # 正規表現を使ってデータを抽出
             # コース種別と距離
-            course_match = re.search(r'(芝|ダート)(\d+)m', race_data_text)
+            course_match = COURSE_DIST_RE.search(race_data_text)
             if course_match:
                 if not 'course_type' in race_info or not race_info['course_type']:
                     race_info['course_type'] = course_match.group(1)
@@ -615,13 +1010,13 @@ def extract_race_info(soup, race_id):
             
             # 馬場状態 - より広範なパターンに対応
             if 'track_condition' not in race_info:
-                track_match = re.search(r'(芝|ダート)\s*[:：]\s*(\S+)', race_data_text)
+                track_match = TRACK_RE.search(race_data_text)
                 if track_match:
                     race_info['track_condition'] = track_match.group(2)
             
             # 天気 - より広範なパターンに対応
             if 'weather' not in race_info:
-                weather_match = re.search(r'天候\s*[:：]\s*(\S+)', race_data_text)
+                weather_match = WEATHER_RE.search(race_data_text)
                 if weather_match:
                     race_info['weather'] = weather_match.group(1)
         
@@ -630,12 +1025,12 @@ def extract_race_info(soup, race_id):
             details_text = race_info['race_details']
             
             if 'weather' not in race_info:
-                weather_match = re.search(r'天候\s*[:：]\s*(\S+)', details_text)
+                weather_match = WEATHER_RE.search(details_text)
                 if weather_match:
                     race_info['weather'] = weather_match.group(1)
             
             if 'track_condition' not in race_info:
-                track_match = re.search(r'(芝|ダート)\s*[:：]\s*(\S+)', details_text)
+                track_match = TRACK_RE.search(details_text)
                 if track_match:
                     race_info['track_condition'] = track_match.group(2)
         
@@ -645,14 +1040,14 @@ def extract_race_info(soup, race_id):
     return race_info
 
 # 馬のIDを抽出
-def extract_horse_ids(soup):
+def extract_horse_ids(root):
     """レース結果ページから馬IDを抽出"""
     horse_ids = []
-    horse_links = soup.select('table.race_table_01 td.horsename a, table.Shutuba_table td.horsename a')
+    horse_links = select(root, 'table.race_table_01 td.horsename a, table.Shutuba_table td.horsename a')
     
     if not horse_links:
         # 代替の方法で馬リンクを探す
-        horse_links = soup.select('a[href*="/horse/"]')
+        horse_links = select(root, 'a[href*="/horse/"]')
     
     for link in horse_links:
         href = link.get('href', '')
@@ -665,8 +1060,92 @@ def extract_horse_ids(soup):
     
     return horse_ids
 
+# 進捗イベントの出力（外部の監視ツールがイベント名で絞り込めるように、1行のJSONでログに書く）
+def emit(event, **fields):
+    logger.info(json.dumps({'event': event, 'ts': time.time(), **fields}, ensure_ascii=False, default=str))
+
+# JSONファイルの書き出し
+def write_json(path, obj, indent=False):
+    """objをUTF-8のJSONとして書き出す（orjsonがあればそちらを使う）"""
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0)
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(obj, option=option))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, ensure_ascii=False, indent=2 if indent else None)
+
+def to_json_line(obj):
+    """objを1行のJSON（改行付きのUTF-8バイト列）にする"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode('utf-8')
+
+# 中断したスクレイピングを再開するためのチェックポイント
+# 中間ファイルとチェックポイントの形式のバージョン（保存する列の構成などを変えたら上げる）
+SCRAPER_VERSION = 1
+
+def checkpoint_path(year, places):
+    """チェックポイントのパス（競馬場ごとに順に実行しても上書きし合わないように、年と競馬場ごとに分ける）"""
+    places_key = '_'.join(sorted(places)) if places else 'all'
+    return f"{OUTPUT_DIR}/race_scraping_checkpoint_{year}_{places_key}.json"
+
+def checkpoint_config_hash(year, places):
+    """チェックポイントが同じ条件・同じ形式の実行で作られたものかを確認するためのハッシュ"""
+    config = {'year': year, 'places': sorted(places) if places else None, 'version': SCRAPER_VERSION}
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+def save_checkpoint(year, places, checkpoint):
+    """チェックポイントを一時ファイルに書き出してから置き換える（書き込み途中で中断しても壊れない）"""
+    path = checkpoint_path(year, places)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def read_checkpoint(year, places):
+    """チェックポイントを読み込む（ない場合や読み込めない場合はNone）"""
+    path = checkpoint_path(year, places)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"Failed to load checkpoint {path}: {str(e)}")
+        return None
+
+def checkpoint_is_compatible(year, places):
+    """チェックポイントがない、または現在の設定・形式で作られたものならTrue"""
+    checkpoint = read_checkpoint(year, places)
+    return checkpoint is None or checkpoint.get('config_hash') == checkpoint_config_hash(year, places)
+
+def load_checkpoint(year, places, force_resume=False):
+    """
+    中断した実行のチェックポイントを読み込む
+    
+    設定や形式が異なる場合はNoneを返す（force_resumeがTrueの場合は警告を出して読み込む）
+    """
+    checkpoint = read_checkpoint(year, places)
+    if checkpoint is None:
+        return None
+    if checkpoint.get('config_hash') != checkpoint_config_hash(year, places):
+        if not force_resume:
+            logger.info(f"Ignoring checkpoint {checkpoint_path(year, places)} created with different settings")
+            return None
+        logger.warning(f"Resuming from checkpoint {checkpoint_path(year, places)} created with different settings (--force_resume)")
+    return checkpoint
+
+def remove_checkpoint(year, places):
+    """収集が最後まで終わったらチェックポイントを削除する"""
+    path = checkpoint_path(year, places)
+    if os.path.exists(path):
+        os.remove(path)
+
 # 複数レースのデータ収集（効率的なバージョン）
-def scrape_races_by_id_pattern_efficient(year, places=None, max_races=None, batch_size=3, pause_between_batches=45):
+def scrape_races_by_id_pattern_efficient(year, places=None, max_races=None, batch_size=3, pause_between_batches=45, force_resume=False):
     """
     より効率的なレースIDパターンに基づいて複数レースの結果を収集する
     
@@ -676,21 +1155,21 @@ def scrape_races_by_id_pattern_efficient(year, places=None, max_races=None, batc
         max_races: 最大収集レース数（Noneの場合は制限なし）
         batch_size: バッチあたりの処理レース数
         pause_between_batches: バッチ間の待機時間（秒）
+        force_resume: 設定や形式が異なるチェックポイントからも再開するか
     
     Returns:
         tuple: レース結果のDataFrame、レース情報リスト、馬IDリスト
     """
-    all_results = []
+    # レース結果はバッチごとにParquetへ書き出し、メモリにはファイルパスだけを保持する
+    batch_results = []
+    result_files = []
     all_race_infos = []
-    all_horse_ids = set()
-    session = create_session()
+    session = get_session()
     
     # 処理したレース数
     processed_count = 0
     # 有効なレース数
     valid_count = 0
-    # バッチ制御用
-    batch_count = 0
     
     # 進捗ファイル
     progress_file = f"{OUTPUT_DIR}/race_scraping_progress_{year}.txt"
@@ -698,8 +1177,9 @@ def scrape_races_by_id_pattern_efficient(year, places=None, max_races=None, batc
     
     # 進捗ファイルが存在する場合は読み込む
     if os.path.exists(progress_file):
+        # 1行1レースIDのファイルを一度に読み込む（空行は無視）
         with open(progress_file, 'r') as f:
-            skip_ids = set([line.strip() for line in f.readlines()])
+            skip_ids = set(f.read().split())
         logger.info(f"Loaded {len(skip_ids)} processed race IDs from progress file")
         
         # 進捗ファイルの削除を確認（デバッグメッセージも追加）
@@ -722,16 +1202,34 @@ def scrape_races_by_id_pattern_efficient(year, places=None, max_races=None, batc
                 
                 # 進捗ファイルを更新（他の競馬場の情報のみを保持）
                 with open(progress_file, 'w') as f:
-                    for race_id in skip_ids:
-                        f.write(f"{race_id}\n")
+                    f.write(''.join(f"{race_id}\n" for race_id in skip_ids))
                 
                 logger.info(f"Progress file updated to skip only {len(skip_ids)} races from other places")
     
-    # 結果の中間保存用タイムスタンプ
+    # 結果の中間保存用タイムスタンプ（この実行で保存する中間ファイルはすべて同じタイムスタンプにする）
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    # レース情報は実行中ずっと同じファイルに追記する
+    race_info_file = f"{OUTPUT_DIR}/intermediate_race_infos_{timestamp}.jsonl"
+    
+    # 同じ条件の実行が中断していた場合は、完了したレースと保存済みの結果を引き継いで再開する
+    config_hash = checkpoint_config_hash(year, places)
+    completed_race_ids = []
+    checkpoint = load_checkpoint(year, places, force_resume)
+    if checkpoint:
+        completed_race_ids = checkpoint.get('completed_race_ids', [])
+        skip_ids.update(completed_race_ids)
+        processed_count = checkpoint.get('processed_count', 0)
+        valid_count = checkpoint.get('valid_count', 0)
+        result_files = [path for path in checkpoint.get('result_files', []) if os.path.exists(path)]
+        if checkpoint.get('race_info_file') and os.path.exists(checkpoint['race_info_file']):
+            race_info_file = checkpoint['race_info_file']
+            all_race_infos = load_intermediate_race_infos(race_info_file)
+        emit('runner.resumed', year=year, completed=len(completed_race_ids), result_files=len(result_files))
+    # 中間ファイルに保存済みのレース情報の数
+    saved_info_count = len(all_race_infos)
     
-    # 有効なレースIDをまとめて取得
-    valid_race_ids = generate_race_ids_efficiently(year, places)
+    # 有効なレースIDをまとめて取得（存在確認で取得したページはデータベースに保存し、結果の取得に再利用する）
+    valid_race_ids = generate_race_ids_efficiently(year, places, keep_pages=True)
     
     if not valid_race_ids:
         logger.warning(f"No valid race IDs generated for {year} with places: {places}")
@@ -746,100 +1244,179 @@ def scrape_races_by_id_pattern_efficient(year, places=None, max_races=None, batc
     logger.info(f"IDs to be skipped: {skip_count}")
     logger.info(f"IDs to be processed: {process_count}")
     
+    # 馬IDはメモリに溜めずSQLiteに書き込む
+    horse_id_db = open_horse_id_db()
+    # 存在確認で保存したページはバッチごとに取り出し、取得が終わったら削除する
+    probe_cache = open_probe_cache()
+    delete_probed_pages(probe_cache, [race_id for race_id in valid_race_ids if race_id in skip_ids])
+    
     try:
-        # 各レースIDを順に処理
+        # 未処理のレースIDだけを対象にする
         for race_id in valid_race_ids:
-            # 既に処理済みのレースはスキップ
             if race_id in skip_ids:
                 logger.info(f"Skipping already processed race: {race_id}")
-                continue
-            
-            processed_count += 1
-            
-            # ランダム間隔で待機（サーバー負荷軽減）
-            if processed_count > 1 and processed_count % 10 == 0:
-                time.sleep(random.uniform(3, 7))
-            
-            # レース結果を取得
-            logger.info(f"Processing valid race: {race_id}")
-            result, race_info = scrape_race_results(race_id, session=session)
-            
-            # 有効なレースデータが取得できた場合のみカウントアップ
-            if result is not None:
-                valid_count += 1
-                batch_count += 1
-                all_results.append(result)
+        pending_ids = [race_id for race_id in valid_race_ids if race_id not in skip_ids]
+        
+        # batch_size件ずつ共有セッションで並列に取得し、バッチ間で待機する
+        # 進捗ファイルは一度だけ開き、バッチごとにフラッシュする
+        with open(progress_file, 'a') as progress_fp, ThreadPoolExecutor(max_workers=SCRAPE_WORKERS) as executor:
+            for start in range(0, len(pending_ids), batch_size):
+                batch_ids = pending_ids[start:start + batch_size]
                 
-                # 馬IDを収集
-                if 'horse_id' in result.columns:
-                    horse_ids = result['horse_id'].dropna().unique()
-                    all_horse_ids.update(horse_ids)
-            
-            if race_info:
-                all_race_infos.append(race_info)
-            
-            # 進捗ファイルに記録
-            with open(progress_file, 'a') as f:
-                f.write(f"{race_id}\n")
-            
-            # バッチが一定数に達したら中間結果を保存
-            if batch_count >= batch_size:
-                # 中間結果の保存
-                if all_results:
-                    save_intermediate_results(all_results, all_race_infos, processed_count)
+                # ランダム間隔で待機（サーバー負荷軽減、10レースごと）
+                # --rate指定時はリクエストごとに間隔を空けるため待機しない
+                if _RATE_LIMITER is None and processed_count > 0 and processed_count // 10 != (processed_count + len(batch_ids)) // 10:
+                    time.sleep(random.uniform(3, 7))
+                processed_count += len(batch_ids)
                 
-                # バッチ間の待機
-                logger.info(f"Pausing for {pause_between_batches} seconds between batches")
-                time.sleep(pause_between_batches)
+                # レース結果を取得（結果はレースIDの順に受け取る）
+                for race_id in batch_ids:
+                    logger.info(f"Processing valid race: {race_id}")
+                probed_pages = load_probed_pages(probe_cache, batch_ids)
+                batch_pages = [probed_pages.get(race_id) for race_id in batch_ids]
+                scraped = executor.map(lambda race_id, page: scrape_race_results(race_id, session=session, page=page), batch_ids, batch_pages)
                 
-                # バッチカウンタをリセット
-                batch_count = 0
-            
-            # 最大レース数に達したら終了
-            if max_races is not None and valid_count >= max_races:
-                logger.info(f"Reached maximum number of races: {max_races}")
-                break
+                reached_max = False
+                for race_id, (result, race_info) in zip(batch_ids, scraped):
+                    # 有効なレースデータが取得できた場合のみカウントアップ
+                    if result is not None:
+                        valid_count += 1
+                        batch_results.append(result)
+                        
+                        # 馬IDを収集
+                        if 'horse_id' in result.columns:
+                            horse_ids = result['horse_id'].dropna().unique()
+                            horse_id_db.executemany("INSERT OR IGNORE INTO horse_id(id, year) VALUES(?, ?)",
+                                                    [(horse_id, year) for horse_id in horse_ids])
+                    
+                    if race_info:
+                        all_race_infos.append(race_info)
+                    
+                    # 進捗ファイルに記録（書き込みはバッファされ、バッチごとにまとめてフラッシュする）
+                    progress_fp.write(f"{race_id}\n")
+                    completed_race_ids.append(race_id)
+                    
+                    # 最大レース数に達したら終了
+                    if max_races is not None and valid_count >= max_races:
+                        logger.info(f"Reached maximum number of races: {max_races}")
+                        reached_max = True
+                        break
+                
+                progress_fp.flush()
+                horse_id_db.commit()
+                delete_probed_pages(probe_cache, batch_ids)
+                
+                # バッチごとに中間結果を保存
+                if batch_results:
+                    result_file = save_intermediate_results(batch_results, all_race_infos[saved_info_count:], processed_count, race_info_file, timestamp)
+                    if result_file:
+                        result_files.append(result_file)
+                    batch_results = []
+                    saved_info_count = len(all_race_infos)
+                    
+                    # 中断時に再開できるようにチェックポイントを更新
+                    save_checkpoint(year, places, {
+                        'config_hash': config_hash,
+                        'processed_count': processed_count,
+                        'valid_count': valid_count,
+                        'last_race_id': completed_race_ids[-1] if completed_race_ids else None,
+                        'completed_race_ids': completed_race_ids,
+                        'result_files': result_files,
+                        'race_info_file': race_info_file,
+                        'timestamp': datetime.now().isoformat(),
+                    })
+                    emit('checkpoint.saved', year=year, processed=processed_count, valid=valid_count,
+                         last_race_id=completed_race_ids[-1] if completed_race_ids else None)
+                
+                if reached_max:
+                    break
+                
+                # バッチ間の待機（--rate指定時は不要）
+                if _RATE_LIMITER is None and start + batch_size < len(pending_ids):
+                    logger.info(f"Pausing for {pause_between_batches} seconds between batches")
+                    time.sleep(pause_between_batches)
+        
+        # 最後まで収集できたのでチェックポイントは不要
+        remove_checkpoint(year, places)
+        emit('runner.completed', year=year, processed=processed_count, valid=valid_count, result_files=len(result_files))
         
         # 最終結果の保存
-        if all_results:
-            combined_df = pd.concat(all_results, ignore_index=True)
-            return combined_df, all_race_infos, list(all_horse_ids)
+        if result_files:
+            combined_df = load_intermediate_results(result_files)
+            return combined_df, all_race_infos, load_horse_ids(horse_id_db, year)
         
-        return None, all_race_infos, list(all_horse_ids)
+        return None, all_race_infos, load_horse_ids(horse_id_db, year)
     
     except Exception as e:
         logger.error(f"Error in scrape_races_by_id_pattern_efficient: {str(e)}")
         # エラーが発生しても中間結果を保存
-        if all_results:
-            save_intermediate_results(all_results, all_race_infos, processed_count)
+        if batch_results:
+            result_file = save_intermediate_results(batch_results, all_race_infos[saved_info_count:], processed_count, race_info_file, timestamp)
+            if result_file:
+                result_files.append(result_file)
+        if result_files:
             try:
-                combined_df = pd.concat(all_results, ignore_index=True)
-                return combined_df, all_race_infos, list(all_horse_ids)
+                combined_df = load_intermediate_results(result_files)
+                return combined_df, all_race_infos, load_horse_ids(horse_id_db, year)
             except:
                 logger.error("Failed to combine results after error")
         
-        return None, all_race_infos, list(all_horse_ids)
+        return None, all_race_infos, load_horse_ids(horse_id_db, year)
+    
+    finally:
+        horse_id_db.commit()
+        horse_id_db.close()
+        probe_cache.close()
 
 # 中間結果を保存
-def save_intermediate_results(results, race_infos, count_index):
-    """スクレイピング中の中間結果を保存"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+def save_intermediate_results(results, race_infos, count_index, race_info_file, timestamp):
+    """
+    スクレイピング中の中間結果を保存
+    
+    レース結果は渡されたバッチ分だけをParquetに書き出す（レースごとに列の型が
+    揺れるため、すべて文字列として保存する）。レース情報は前回の保存以降に
+    増えた分だけをrace_info_file（JSON Lines）に追記する
+    
+    ファイル名には実行開始時のtimestampとcount_indexを使う（同じ実行の中間ファイルは同じタイムスタンプになる）
+    
+    Returns:
+        str: 保存したレース結果ファイルのパス（保存できなかった場合はNone）
+    """
+    result_file = None
     if results:
         try:
-            combined_df = pd.concat(results, ignore_index=True)
-            combined_df.to_csv(f"{OUTPUT_DIR}/intermediate_races_{timestamp}_{count_index}.csv", 
-                               index=False, encoding='utf-8-sig')
-            logger.info(f"Saved intermediate results to intermediate_races_{timestamp}_{count_index}.csv")
+            batch_df = (results[0] if len(results) == 1 else pd.concat(results, ignore_index=True)).astype('string')
+            filename = f"intermediate_races_{timestamp}_{count_index}.parquet"
+            path = f"{OUTPUT_DIR}/{filename}"
+            # 書き込み途中で中断しても壊れたファイルが残らないように、一時ファイルから置き換える
+            batch_df.to_parquet(f"{path}.tmp", index=False)
+            os.replace(f"{path}.tmp", path)
+            result_file = path
+            emit('checkpoint.results_saved', path=path, rows=len(batch_df), count_index=count_index)
         except Exception as e:
             logger.error(f"Failed to save intermediate race results: {str(e)}")
     
     if race_infos:
         try:
-            with open(f"{OUTPUT_DIR}/intermediate_race_infos_{timestamp}_{count_index}.json", 'w', encoding='utf-8') as f:
-                json.dump(race_infos, f, ensure_ascii=False, indent=2)
-            logger.info(f"Saved intermediate race info to intermediate_race_infos_{timestamp}_{count_index}.json")
+            with open(race_info_file, 'ab') as f:
+                f.writelines(to_json_line(race_info) for race_info in race_infos)
+            emit('checkpoint.race_infos_appended', path=race_info_file, count=len(race_infos), count_index=count_index)
         except Exception as e:
             logger.error(f"Failed to save intermediate race info: {str(e)}")
+    
+    return result_file
+
+# 中間結果のレース情報ファイル（JSON Lines）を読み込む
+def load_intermediate_race_infos(race_info_file):
+    with open(race_info_file, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# 中間結果のレース結果ファイルを読み込んで結合
+def load_intermediate_results(result_files):
+    """バッチごとに保存したレース結果のParquetファイルを1つのDataFrameにまとめる"""
+    if len(result_files) == 1:
+        return pd.read_parquet(result_files[0])
+    return pd.concat([pd.read_parquet(path) for path in result_files], ignore_index=True)
 
 # コマンドライン引数の解析
 def parse_args():
@@ -858,11 +1435,25 @@ def parse_args():
                         help='Use efficient race ID generation method')
     parser.add_argument('--reset_progress', action='store_true',
                         help='Reset progress for the specified places')
+    parser.add_argument('--force_resume', action='store_true',
+                        help='Resume from a checkpoint even if it was created with different settings or an older scraper version')
+    parser.add_argument('--debug', action='store_true',
+                        help='Save fetched race HTML to the debug directory')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Send requests at a steady rate of at most this many per second instead of pausing between batches, slowing down on 429/503 (0 to disable)')
+    
+    args = parser.parse_args()
     
-    return parser.parse_args()
+    # 存在しない競馬場コードでは何時間待ってもデータが取れないため、開始前にエラーにする
+    unknown_places = [p for p in (args.places or []) if p not in PLACE_DICT]
+    if unknown_places:
+        parser.error(f"Unknown place codes: {', '.join(unknown_places)} (valid: {', '.join(PLACE_DICT)})")
+    
+    return args
 
 # メイン実行関数
 def main():
+    global DEBUG_HTML, _RATE_LIMITER
     args = parse_args()
     year = args.year
     places = args.places  # None or list
@@ -872,6 +1463,13 @@ def main():
     use_efficient = args.efficient
     reset_progress = args.reset_progress
     
+    if args.debug:
+        DEBUG_HTML = True
+        os.makedirs(DEBUG_DIR, exist_ok=True)
+    
+    if args.rate > 0:
+        _RATE_LIMITER = RateLimiter(args.rate)
+    
     print(f"Starting race data collection for {year}")
     
     # 競馬場が指定されている場合
@@ -881,7 +1479,7 @@ def main():
     else:
         print(f"Targeting all race places")
     
-    print(f"Settings: batch_size={batch_size}, pause={pause_time}s, max_races={max_races or 'unlimited'}, efficient_mode={use_efficient}")
+    print(f"Settings: batch_size={batch_size}, pause={pause_time}s, max_races={max_races or 'unlimited'}, efficient_mode={use_efficient}, rate={args.rate or 'off'}")
     
     # 進捗ファイルのリセット
     if reset_progress and places:
@@ -897,21 +1495,10 @@ def main():
             
             # 新しい進捗ファイルを作成 (他の場所は保持)
             try:
-                with open(backup_file, 'r') as f_in:
-                    lines = f_in.readlines()
-                
-                # 指定した場所以外のエントリを保持
-                year_str = str(year)
-                filtered_lines = []
-                for line in lines:
-                    race_id = line.strip()
-                    place_code = race_id[4:6] if len(race_id) >= 6 else ""
-                    # 指定された場所のエントリをスキップ
-                    if place_code not in places:
-                        filtered_lines.append(line)
-                
-                with open(progress_file, 'w') as f_out:
-                    f_out.writelines(filtered_lines)
+                # 指定した場所以外のエントリを保持（レースIDの先頭6桁＝年＋場所コードで判定し、1行ずつ書き出す）
+                skip_prefixes = {f"{year}{place}" for place in places}
+                with open(backup_file, 'r') as f_in, open(progress_file, 'w') as f_out:
+                    f_out.writelines(line for line in f_in if line.strip()[:6] not in skip_prefixes)
                 
                 print(f"Reset progress for places: {', '.join(places)}")
             except Exception as e:
@@ -920,8 +1507,14 @@ def main():
             print("No progress file found to reset")
     
     # レースデータ収集（効率的な方法のみサポート）
+    # 設定や形式の異なる実行のチェックポイントが残っている場合は、列構成の混在を防ぐため中止する
+    if not checkpoint_is_compatible(year, places) and not args.force_resume:
+        print(f"Error: checkpoint {checkpoint_path(year, places)} was created with different settings or scraper version")
+        print("Use --force_resume to resume from it anyway, or delete the file to start over")
+        return
+    
     races_df, race_detailed_infos, horse_ids = scrape_races_by_id_pattern_efficient(
-        year, places, max_races, batch_size, pause_time
+        year, places, max_races, batch_size, pause_time, args.force_resume
     )
     
     # 結果の保存
@@ -937,18 +1530,16 @@ def main():
         if 'track_condition' not in races_df.columns:
             logger.warning("Track condition information is missing in the dataframe")
         
-        races_df.to_csv(f"{OUTPUT_DIR}/{filename}", index=False, encoding='utf-8-sig')
+        write_csv(races_df, f"{OUTPUT_DIR}/{filename}")
         print(f"Saved race data to {filename}")
         
         info_filename = f"race_infos_{year}_{timestamp}.json"
-        with open(f"{OUTPUT_DIR}/{info_filename}", 'w', encoding='utf-8') as f:
-            json.dump(race_detailed_infos, f, ensure_ascii=False, indent=2)
+        write_json(f"{OUTPUT_DIR}/{info_filename}", race_detailed_infos, indent=True)
         print(f"Saved race info to {info_filename}")
         
         # 馬IDを保存
         horse_filename = f"horse_ids_{year}_{timestamp}.json"
-        with open(f"{OUTPUT_DIR}/{horse_filename}", 'w', encoding='utf-8') as f:
-            json.dump(horse_ids, f, ensure_ascii=False)
+        write_json(f"{OUTPUT_DIR}/{horse_filename}", horse_ids)
         print(f"Saved {len(horse_ids)} horse IDs to {horse_filename}")
     else:
         print("Failed to collect any race data")
@@ -1,9 +1,22 @@
 import pandas as pd
 import numpy as np
+import matplotlib
+# グラフは画面に表示せずファイルに保存するだけなので、非対話型のAggバックエンドを使う
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
 from datetime import datetime
+import glob
+from keiba_utils import read_csv_cached
+import hashlib
+import json
+
+# 成績の集計には、インストールされていればNumbaでJITコンパイルした関数を使う（なければpandasのgroupby）
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 # 前処理済みデータが保存されているディレクトリ
 input_dir = 'preprocessed_data'
@@ -11,21 +24,51 @@ input_dir = 'preprocessed_data'
 output_dir = 'analysis_results'
 os.makedirs(output_dir, exist_ok=True)
 
+# グラフ用のFigure（グラフごとに作成・破棄せず、1つを消去して使い回す）
+_plot_fig = None
+
+def _new_figure(figsize):
+    """使い回しのFigureを消去して指定サイズにし、現在のFigureとして返す"""
+    global _plot_fig
+    if _plot_fig is None:
+        _plot_fig = plt.figure(figsize=figsize)
+    else:
+        _plot_fig.clf()
+        _plot_fig.set_size_inches(figsize)
+        plt.figure(_plot_fig.number)
+    return _plot_fig
+
+# 分析で使うレースデータの列（レース結果の他の列は読み込まず、データが大きくてもメモリを抑える）
+RACE_ANALYSIS_COLS = [
+    'race_id', 'horse_id', 'race_date', '着順_数値', 'タイム_秒', 'distance',
+    'course_type', 'track_condition', 'weather', '騎手', 'trainer'
+]
+
+def _latest_file(pattern):
+    """input_dir内でパターンに一致する最新の前処理済みファイルのパスを返す（なければNone）"""
+    files = sorted(glob.glob(f'{input_dir}/{pattern}'), reverse=True)
+    return files[0] if files else None
+
 def load_preprocessed_data():
     """前処理済みデータを読み込む関数"""
     print("=== 前処理済みデータの読み込みを開始 ===")
     
     # 最新の前処理済みファイルを検索
-    race_files = sorted(glob.glob(f'{input_dir}/cleaned_races_*.csv'), reverse=True)
-    horse_info_files = sorted(glob.glob(f'{input_dir}/cleaned_horse_info_*.csv'), reverse=True)
-    horse_history_files = sorted(glob.glob(f'{input_dir}/cleaned_horse_history_*.csv'), reverse=True)
+    race_file = _latest_file('cleaned_races_*.csv')
+    horse_info_file = _latest_file('cleaned_horse_info_*.csv')
+    horse_history_file = _latest_file('cleaned_horse_history_*.csv')
     
     # 最新のファイルを読み込む
-    races_df = pd.read_csv(race_files[0], encoding='utf-8-sig') if race_files else None
-    horse_info_df = pd.read_csv(horse_info_files[0], encoding='utf-8-sig') if horse_info_files else None
-    horse_history_df = pd.read_csv(horse_history_files[0], encoding='utf-8-sig') if horse_history_files else None
+    races_df = read_csv_cached(race_file, columns=RACE_ANALYSIS_COLS) if race_file else None
+    horse_info_df = read_csv_cached(horse_info_file) if horse_info_file else None
+    horse_history_df = read_csv_cached(horse_history_file) if horse_history_file else None
     
     if races_df is not None:
+        # 日付の変換は重いので、読み込み時に一度だけ行い年・月の列も作っておく
+        if 'race_date' in races_df.columns:
+            races_df['race_date'] = pd.to_datetime(races_df['race_date'], format='ISO8601', errors='coerce')
+            races_df['year'] = races_df['race_date'].dt.year.astype('Int16')
+            races_df['month'] = races_df['race_date'].dt.month.astype('Int8')
         print(f"レースデータ: {len(races_df)}行, {races_df.shape[1]}列")
     else:
         print("レースデータが見つかりませんでした。")
@@ -44,6 +87,21 @@ def load_preprocessed_data():
     
     return races_df, horse_info_df, horse_history_df
 
+# 集計のキーに使う文字列の列（カテゴリ型にして、groupbyで整数コードをハッシュするようにする）
+# race_idは各集計でレース数（nunique）を数えるのに使うので、同じく整数コードで数えられるようにする
+CATEGORY_KEY_COLS = ['騎手', 'trainer', 'course_type', 'track_condition', 'weather', 'horse_id', 'race_id']
+
+def optimize_dtypes(races_df):
+    """集計のキー列をカテゴリ型に、整数の列を最小の整数型に変換してメモリを減らす"""
+    conversions = {col: 'category' for col in CATEGORY_KEY_COLS if col in races_df.columns}
+    for col in races_df.select_dtypes('integer').columns:
+        conversions[col] = pd.to_numeric(races_df[col], downcast='integer').dtype
+    return races_df.astype(conversions)
+
+def decategorize(df):
+    """集計結果のカテゴリ型の列を元の値の列に戻す（グラフに未使用のカテゴリが並ばず、データの順に表示されるようにする）"""
+    return df.astype({col: df[col].cat.categories.dtype for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+
 def analyze_race_statistics(races_df):
     """レースデータの基本統計分析"""
     print("=== レースデータの基本統計分析を開始 ===")
@@ -62,62 +120,59 @@ def analyze_race_statistics(races_df):
         time_stats.to_csv(f'{output_dir}/time_statistics.csv')
     
     # 年ごとのレース数
-    if 'race_date' in races_df.columns:
-        # 日付型に変換
-        if not pd.api.types.is_datetime64_dtype(races_df['race_date']):
-            races_df['race_date'] = pd.to_datetime(races_df['race_date'], errors='coerce')
-        
-        races_df['year'] = races_df['race_date'].dt.year
-        yearly_races = races_df.groupby('year').size()
+    if 'year' in races_df.columns:
+        # 年・月ごとの件数を一度だけ集計し、年ごとの件数はそこから合計する
+        year_month_counts = races_df.groupby(['year', 'month']).size()
+        yearly_races = year_month_counts.groupby(level='year').sum()
         print("\n年ごとのレース数:")
         print(yearly_races)
         
         # グラフを作成
-        plt.figure(figsize=(10, 6))
+        _new_figure((10, 6))
         yearly_races.plot(kind='bar')
         plt.title('年ごとのレース数')
         plt.xlabel('年')
         plt.ylabel('レース数')
         plt.tight_layout()
         plt.savefig(f'{output_dir}/yearly_races.png')
-        plt.close()
         
         # 月ごとのレース数
-        races_df['month'] = races_df['race_date'].dt.month
-        monthly_races = races_df.groupby(['year', 'month']).size().unstack()
+        monthly_races = year_month_counts.unstack()
         
-        plt.figure(figsize=(12, 8))
-        monthly_races.plot(kind='bar', stacked=True)
+        _new_figure((12, 8))
+        monthly_races.plot(kind='bar', stacked=True, ax=plt.gca())
         plt.title('年・月別レース数')
         plt.xlabel('年')
         plt.ylabel('レース数')
         plt.legend(title='月')
         plt.tight_layout()
         plt.savefig(f'{output_dir}/monthly_races_by_year.png')
-        plt.close()
     
     # コース種別ごとのレース数
     if 'course_type' in races_df.columns:
-        course_races = races_df.groupby('course_type').size()
+        # 単一キーの件数なのでgroupbyではなくvalue_countsで数える（円グラフのラベルに列名が出ないよう名前は外す）
+        course_races = races_df['course_type'].value_counts(sort=False).sort_index().rename(None)
         print("\nコース種別ごとのレース数:")
         print(course_races)
         
-        plt.figure(figsize=(10, 6))
+        _new_figure((10, 6))
         course_races.plot(kind='pie', autopct='%1.1f%%')
         plt.title('コース種別の割合')
         plt.tight_layout()
         plt.savefig(f'{output_dir}/course_type_distribution.png')
-        plt.close()
     
     # 馬場状態ごとの平均タイム
     if 'track_condition' in races_df.columns and 'タイム_秒' in races_df.columns:
-        track_times = races_df.groupby(['track_condition', 'distance'])['タイム_秒'].mean().reset_index()
+        # 詳細な統計情報を一度の集計で求め、グラフの平均タイムもここから使う
+        detailed_track_stats = decategorize(races_df.groupby(['track_condition', 'distance'], observed=True).agg({
+            'タイム_秒': ['count', 'mean', 'std', 'min', 'max'],
+            'race_id': 'nunique'
+        }).reset_index())
+        detailed_track_stats.columns = ['馬場状態', '距離', 'サンプル数', '平均タイム', 'タイム標準偏差', '最速タイム', '最遅タイム', 'レース数']
         
-        plt.figure(figsize=(12, 8))
-        for track in track_times['track_condition'].unique():
-            data = track_times[track_times['track_condition'] == track]
-            if len(data) > 0:  # データが存在する場合のみプロット
-                plt.plot(data['distance'], data['タイム_秒'], 'o-', label=track)
+        # 馬場状態を列にした表に変形して、全ての線を一度に描く
+        _new_figure((12, 8))
+        detailed_track_stats.pivot(index='距離', columns='馬場状態', values='平均タイム').plot(marker='o', ax=plt.gca())
         
         plt.title('馬場状態別の平均タイム（距離別）')
         plt.xlabel('距離 (m)')
@@ -125,19 +180,75 @@ def analyze_race_statistics(races_df):
         plt.legend()
         plt.grid(True)
         plt.savefig(f'{output_dir}/track_condition_times.png')
-        plt.close()
         
         # 詳細な統計情報をCSVとして保存
-        detailed_track_stats = races_df.groupby(['track_condition', 'distance']).agg({
-            'タイム_秒': ['count', 'mean', 'std', 'min', 'max'],
-            'race_id': 'nunique'
-        }).reset_index()
-        
-        detailed_track_stats.columns = ['馬場状態', '距離', 'サンプル数', '平均タイム', 'タイム標準偏差', '最速タイム', '最遅タイム', 'レース数']
         detailed_track_stats.to_csv(f'{output_dir}/track_condition_detailed_stats.csv', index=False, encoding='utf-8-sig')
     
     print("=== レースデータの基本統計分析が完了 ===")
 
+def add_result_flags(races_df):
+    """着順から勝利・3着以内のフラグ列（bool）を追加する（集計をlambdaではなく列の合計で行うため）"""
+    rank = races_df['着順_数値']
+    return races_df.assign(is_win=rank == 1, is_place=rank.between(1, 3))
+
+def _rate_kernel(codes, rank, n_groups):
+    """グループコードごとの出走数・勝利数・3着以内数・着順の合計と件数を1回のループで数える"""
+    count = np.zeros(n_groups, np.int64)
+    win_count = np.zeros(n_groups, np.int64)
+    place_count = np.zeros(n_groups, np.int64)
+    rank_sum = np.zeros(n_groups, np.float64)
+    rank_count = np.zeros(n_groups, np.int64)
+    for i in range(codes.size):
+        g = codes[i]
+        if g < 0:  # キーが欠損している行はgroupbyと同じく除外
+            continue
+        count[g] += 1
+        r = rank[i]
+        if np.isnan(r):  # 着順が欠損している行は出走数にだけ数える
+            continue
+        rank_sum[g] += r
+        rank_count[g] += 1
+        if r == 1:
+            win_count[g] += 1
+        if 1 <= r <= 3:
+            place_count[g] += 1
+    return count, win_count, place_count, rank_sum, rank_count
+
+if njit is not None:
+    _rate_kernel = njit(cache=True)(_rate_kernel)
+
+def _rate_table(races_df, key, min_n, count_col='races_count', sort_col='win_rate', topn=20):
+    """キーごとの出走数・勝利数・3着以内数・平均着順と勝率・連対率を集計し、
+    最低出走数を満たす行（qualified）とsort_colの上位topn行を返す"""
+    if njit is not None:
+        codes, uniques = pd.factorize(races_df[key], sort=True)
+        rank = races_df['着順_数値'].to_numpy(dtype=np.float64, na_value=np.nan)
+        count, win_count, place_count, rank_sum, rank_count = _rate_kernel(codes, rank, len(uniques))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg_rank = rank_sum / rank_count
+        stats = decategorize(pd.DataFrame({
+            key: uniques,
+            count_col: count,
+            'win_count': win_count,
+            'place_count': place_count,
+            'avg_rank': avg_rank
+        }))
+    else:
+        stats = decategorize(races_df.groupby(key, observed=True).agg(
+            **{count_col: ('race_id', 'size')},
+            win_count=('is_win', 'sum'),
+            place_count=('is_place', 'sum'),
+            avg_rank=('着順_数値', 'mean')
+        ).reset_index())
+    
+    # 勝率と連対率を計算
+    stats['win_rate'] = stats['win_count'] / stats[count_col] * 100
+    stats['place_rate'] = stats['place_count'] / stats[count_col] * 100
+    
+    # 十分な出走数のある行のみをフィルタリング
+    qualified = stats[stats[count_col] >= min_n]
+    return qualified, qualified.nlargest(topn, sort_col)
+
 def analyze_horse_performance(races_df, horse_info_df):
     """馬のパフォーマンス分析"""
     print("=== 馬のパフォーマンス分析を開始 ===")
@@ -151,64 +262,45 @@ def analyze_horse_performance(races_df, horse_info_df):
         # 十分な出走回数のある馬のみ対象
         min_races = 5
         
-        # 馬ごとの成績を集計
-        horse_stats = races_df.groupby('horse_id').agg(
-            races_count=('race_id', 'count'),
-            win_count=('着順_数値', lambda x: sum(x == 1)),
-            place_count=('着順_数値', lambda x: sum((x >= 1) & (x <= 3))),
-            avg_rank=('着順_数値', 'mean')
-        ).reset_index()
-        
-        # 勝率と連対率を計算
-        horse_stats['win_rate'] = horse_stats['win_count'] / horse_stats['races_count'] * 100
-        horse_stats['place_rate'] = horse_stats['place_count'] / horse_stats['races_count'] * 100
-        
-        # 十分な出走回数のある馬のみをフィルタリング
-        qualified_horses = horse_stats[horse_stats['races_count'] >= min_races]
-        
-        # 勝率上位の馬
-        top_win_horses = qualified_horses.sort_values('win_rate', ascending=False).head(20)
+        # 馬ごとの成績を集計（十分な出走回数のある馬と勝率上位の馬）
+        races_df = add_result_flags(races_df)
+        qualified_horses, top_win_horses = _rate_table(races_df, 'horse_id', min_races)
         print("\n勝率上位の馬:")
         print(top_win_horses[['horse_id', 'races_count', 'win_count', 'win_rate']])
         
-        # 馬名を結合（可能な場合）
+        # 馬名の対応表（horse_id→馬名）を一度だけ作っておく（可能な場合）
+        horse_names = None
         if horse_info_df is not None and 'horse_id' in horse_info_df.columns and 'name' in horse_info_df.columns:
-            top_win_horses = top_win_horses.merge(
-                horse_info_df[['horse_id', 'name']], 
-                on='horse_id', 
-                how='left'
-            )
+            horse_names = horse_info_df.drop_duplicates('horse_id').set_index('horse_id')['name']
+        
+        # 上位の馬は20頭だけなので、結合ではなく対応表から馬名を引く
+        if horse_names is not None:
+            top_win_horses = top_win_horses.assign(name=top_win_horses['horse_id'].map(horse_names))
         
         # 勝率上位馬をグラフ化
-        plt.figure(figsize=(12, 8))
+        _new_figure((12, 8))
         x_col = 'name' if 'name' in top_win_horses.columns else 'horse_id'
         sns.barplot(x=x_col, y='win_rate', data=top_win_horses)
         plt.title(f'勝率上位の馬（最低{min_races}レース出走）')
         plt.xticks(rotation=90)
         plt.tight_layout()
         plt.savefig(f'{output_dir}/top_win_rate_horses.png')
-        plt.close()
         
         # 連対率上位の馬
-        top_place_horses = qualified_horses.sort_values('place_rate', ascending=False).head(20)
+        top_place_horses = qualified_horses.nlargest(20, 'place_rate')
         
-        # 馬名を結合（可能な場合）
-        if horse_info_df is not None and 'horse_id' in horse_info_df.columns and 'name' in horse_info_df.columns:
-            top_place_horses = top_place_horses.merge(
-                horse_info_df[['horse_id', 'name']], 
-                on='horse_id', 
-                how='left'
-            )
+        # 馬名を付ける（可能な場合）
+        if horse_names is not None:
+            top_place_horses = top_place_horses.assign(name=top_place_horses['horse_id'].map(horse_names))
         
         # 連対率上位馬をグラフ化
-        plt.figure(figsize=(12, 8))
+        _new_figure((12, 8))
         x_col = 'name' if 'name' in top_place_horses.columns else 'horse_id'
         sns.barplot(x=x_col, y='place_rate', data=top_place_horses)
         plt.title(f'連対率上位の馬（最低{min_races}レース出走）')
         plt.xticks(rotation=90)
         plt.tight_layout()
         plt.savefig(f'{output_dir}/top_place_rate_horses.png')
-        plt.close()
         
         # 詳細な馬の成績を保存
         if horse_info_df is not None and 'horse_id' in horse_info_df.columns:
@@ -230,49 +322,37 @@ def analyze_jockey_trainer_performance(races_df):
         print("レースデータがありません。")
         return
     
+    # 勝利・3着以内のフラグ列を一度だけ作っておく
+    if '着順_数値' in races_df.columns:
+        races_df = add_result_flags(races_df)
+    
     # 騎手の成績分析
     if '騎手' in races_df.columns and '着順_数値' in races_df.columns:
         # 十分な騎乗回数のある騎手のみ対象
         min_rides = 50
         
-        # 騎手ごとの成績を集計
-        jockey_stats = races_df.groupby('騎手').agg(
-            rides_count=('race_id', 'count'),
-            win_count=('着順_数値', lambda x: sum(x == 1)),
-            place_count=('着順_数値', lambda x: sum((x >= 1) & (x <= 3))),
-            avg_rank=('着順_数値', 'mean')
-        ).reset_index()
-        
-        # 勝率と連対率を計算
-        jockey_stats['win_rate'] = jockey_stats['win_count'] / jockey_stats['rides_count'] * 100
-        jockey_stats['place_rate'] = jockey_stats['place_count'] / jockey_stats['rides_count'] * 100
-        
-        # 十分な騎乗回数のある騎手のみをフィルタリング
-        qualified_jockeys = jockey_stats[jockey_stats['rides_count'] >= min_rides]
-        
-        # 勝率上位の騎手
-        top_jockeys = qualified_jockeys.sort_values('win_rate', ascending=False).head(20)
+        # 騎手ごとの成績を集計（十分な騎乗回数のある騎手と勝率上位の騎手）
+        qualified_jockeys, top_jockeys = _rate_table(races_df, '騎手', min_rides, count_col='rides_count')
         print("\n勝率上位の騎手:")
         print(top_jockeys[['騎手', 'rides_count', 'win_count', 'win_rate']])
         
         # 勝率上位騎手をグラフ化
-        plt.figure(figsize=(12, 8))
+        _new_figure((12, 8))
         sns.barplot(x='騎手', y='win_rate', data=top_jockeys)
         plt.title(f'勝率上位の騎手（最低{min_rides}回騎乗）')
         plt.xticks(rotation=90)
         plt.tight_layout()
         plt.savefig(f'{output_dir}/top_jockeys.png')
-        plt.close()
         
         # 騎手のコース別勝率
         if 'course_type' in races_df.columns:
             # 十分なデータがあるコース・騎手の組み合わせのみ対象
             min_course_rides = 30
             
-            jockey_course_stats = races_df.groupby(['騎手', 'course_type']).agg(
-                rides_count=('race_id', 'count'),
-                win_count=('着順_数値', lambda x: sum(x == 1))
-            ).reset_index()
+            jockey_course_stats = decategorize(races_df.groupby(['騎手', 'course_type'], observed=True).agg(
+                rides_count=('race_id', 'size'),
+                win_count=('is_win', 'sum')
+            ).reset_index())
             
             jockey_course_stats['win_rate'] = jockey_course_stats['win_count'] / jockey_course_stats['rides_count'] * 100
             
@@ -287,12 +367,11 @@ def analyze_jockey_trainer_performance(races_df):
             if len(top_jockey_courses) > 0:
                 pivot_data = top_jockey_courses.pivot(index='騎手', columns='course_type', values='win_rate')
                 
-                plt.figure(figsize=(10, 8))
+                _new_figure((10, 8))
                 sns.heatmap(pivot_data, annot=True, fmt='.1f', cmap='YlGnBu')
                 plt.title('騎手のコース別勝率(%)')
                 plt.tight_layout()
                 plt.savefig(f'{output_dir}/jockey_course_win_rates.png')
-                plt.close()
         
         # 騎手の詳細な成績を保存
         qualified_jockeys.to_csv(f'{output_dir}/jockey_performance_stats.csv', index=False, encoding='utf-8-sig')
@@ -302,34 +381,18 @@ def analyze_jockey_trainer_performance(races_df):
         # 十分な頭数のある調教師のみ対象
         min_horses = 30
         
-        # 調教師ごとの成績を集計
-        trainer_stats = races_df.groupby('trainer').agg(
-            horses_count=('race_id', 'count'),
-            win_count=('着順_数値', lambda x: sum(x == 1)),
-            place_count=('着順_数値', lambda x: sum((x >= 1) & (x <= 3))),
-            avg_rank=('着順_数値', 'mean')
-        ).reset_index()
-        
-        # 勝率と連対率を計算
-        trainer_stats['win_rate'] = trainer_stats['win_count'] / trainer_stats['horses_count'] * 100
-        trainer_stats['place_rate'] = trainer_stats['place_count'] / trainer_stats['horses_count'] * 100
-        
-        # 十分な頭数のある調教師のみをフィルタリング
-        qualified_trainers = trainer_stats[trainer_stats['horses_count'] >= min_horses]
-        
-        # 勝率上位の調教師
-        top_trainers = qualified_trainers.sort_values('win_rate', ascending=False).head(20)
+        # 調教師ごとの成績を集計（十分な頭数のある調教師と勝率上位の調教師）
+        qualified_trainers, top_trainers = _rate_table(races_df, 'trainer', min_horses, count_col='horses_count')
         print("\n勝率上位の調教師:")
         print(top_trainers[['trainer', 'horses_count', 'win_count', 'win_rate']])
         
         # 勝率上位調教師をグラフ化
-        plt.figure(figsize=(12, 8))
+        _new_figure((12, 8))
         sns.barplot(x='trainer', y='win_rate', data=top_trainers)
         plt.title(f'勝率上位の調教師（最低{min_horses}頭）')
         plt.xticks(rotation=90)
         plt.tight_layout()
         plt.savefig(f'{output_dir}/top_trainers.png')
-        plt.close()
         
         # 調教師の詳細な成績を保存
         qualified_trainers.to_csv(f'{output_dir}/trainer_performance_stats.csv', index=False, encoding='utf-8-sig')
@@ -348,33 +411,22 @@ def analyze_track_weather_season(races_df):
     if 'track_condition' in races_df.columns and 'タイム_秒' in races_df.columns:
         # コース種別ごとに馬場状態の影響を分析
         if 'course_type' in races_df.columns:
-            plt.figure(figsize=(15, 10))
-            
-            course_types = races_df['course_type'].unique()
-            
-            for i, course in enumerate(course_types):
-                if len(course_types) <= 3:
-                    plt.subplot(len(course_types), 1, i+1)
-                else:
-                    # コースタイプが多い場合は2行に分ける
-                    plt.subplot(2, (len(course_types) + 1) // 2, i+1)
-                
-                course_data = races_df[races_df['course_type'] == course]
-                
-                if len(course_data) > 0:  # データが存在する場合のみプロット
-                    sns.boxplot(x='track_condition', y='タイム_秒', data=course_data)
-                    
-                    plt.title(f'{course}コースにおける馬場状態別のタイム分布')
-                    plt.xlabel('馬場状態')
-                    plt.ylabel('タイム (秒)')
-                    plt.grid(True, linestyle='--', alpha=0.7)
-            
-            plt.tight_layout()
-            plt.savefig(f'{output_dir}/track_condition_impact.png')
-            plt.close()
+            # コース種別ごとの箱ひげ図をFacetGridで一度に描く（コースごとにデータを絞り込まない）
+            g = sns.catplot(
+                data=races_df[['course_type', 'track_condition', 'タイム_秒']],
+                x='track_condition', y='タイム_秒', col='course_type',
+                kind='box', col_wrap=2, height=4, aspect=1.5, sharey=False
+            )
+            g.set_titles('{col_name}コースにおける馬場状態別のタイム分布')
+            g.set_axis_labels('馬場状態', 'タイム (秒)')
+            for ax in g.axes.flat:
+                ax.grid(True, linestyle='--', alpha=0.7)
+            g.tight_layout()
+            g.savefig(f'{output_dir}/track_condition_impact.png')
+            plt.close(g.figure)
             
             # 馬場状態別の詳細データを保存
-            track_condition_stats = races_df.groupby(['course_type', 'track_condition']).agg({
+            track_condition_stats = races_df.groupby(['course_type', 'track_condition'], observed=True).agg({
                 'タイム_秒': ['count', 'mean', 'std', 'min', 'max'],
                 'race_id': 'nunique'
             }).reset_index()
@@ -385,13 +437,11 @@ def analyze_track_weather_season(races_df):
     # 天候の影響分析
     if 'weather' in races_df.columns and 'タイム_秒' in races_df.columns:
         # 天候別の平均タイム
-        weather_times = races_df.groupby(['weather', 'distance'])['タイム_秒'].mean().reset_index()
+        weather_times = decategorize(races_df.groupby(['weather', 'distance'], observed=True)['タイム_秒'].mean().reset_index())
         
-        plt.figure(figsize=(12, 8))
-        for weather in weather_times['weather'].unique():
-            data = weather_times[weather_times['weather'] == weather]
-            if len(data) > 0:  # データが存在する場合のみプロット
-                plt.plot(data['distance'], data['タイム_秒'], 'o-', label=weather)
+        # 天候を列にした表に変形して、全ての線を一度に描く
+        _new_figure((12, 8))
+        weather_times.pivot(index='distance', columns='weather', values='タイム_秒').plot(marker='o', ax=plt.gca())
         
         plt.title('天候別の平均タイム（距離別）')
         plt.xlabel('距離 (m)')
@@ -399,10 +449,9 @@ def analyze_track_weather_season(races_df):
         plt.legend()
         plt.grid(True)
         plt.savefig(f'{output_dir}/weather_times.png')
-        plt.close()
         
         # 天候別の詳細データを保存
-        weather_stats = races_df.groupby(['weather']).agg({
+        weather_stats = races_df.groupby(['weather'], observed=True).agg({
             'タイム_秒': ['count', 'mean', 'std'],
             'race_id': 'nunique'
         }).reset_index()
@@ -411,17 +460,13 @@ def analyze_track_weather_season(races_df):
         weather_stats.to_csv(f'{output_dir}/weather_stats.csv', index=False, encoding='utf-8-sig')
     
     # 季節の影響分析
-    if 'race_date' in races_df.columns:
-        # 日付型に変換
-        if not pd.api.types.is_datetime64_dtype(races_df['race_date']):
-            races_df['race_date'] = pd.to_datetime(races_df['race_date'], errors='coerce')
-        
-        races_df['month'] = races_df['race_date'].dt.month
-        
+    if 'month' in races_df.columns:
         # 月ごとのレース数
-        monthly_races = races_df.groupby('month').size()
+        # 月は1〜12の整数なのでbincountで数える（レースのない月も0件として12か月分そろえる）
+        months = races_df['month'].dropna().to_numpy(dtype=np.int64)
+        monthly_races = pd.Series(np.bincount(months, minlength=13)[1:], index=pd.RangeIndex(1, 13, name='month'))
         
-        plt.figure(figsize=(10, 6))
+        _new_figure((10, 6))
         monthly_races.plot(kind='bar')
         plt.title('月ごとのレース数')
         plt.xlabel('月')
@@ -430,32 +475,30 @@ def analyze_track_weather_season(races_df):
         plt.grid(True, axis='y', linestyle='--', alpha=0.7)
         plt.tight_layout()
         plt.savefig(f'{output_dir}/monthly_races.png')
-        plt.close()
         
         # 月ごとの平均タイム（特定距離のレースのみ）
         if 'distance' in races_df.columns and 'タイム_秒' in races_df.columns:
             # 一般的な距離を選択（例: 1600m, 1800m, 2000m）
             common_distances = [1600, 1800, 2000]
             
-            plt.figure(figsize=(15, 10))
+            # 距離・月ごとの平均タイムを一度に集計し、距離ごとの折れ線をFacetGridで描く
+            monthly_times = races_df[races_df['distance'].isin(common_distances)].groupby(['distance', 'month'])['タイム_秒'].mean().reset_index()
+            # 集計後の月に欠損は残らないので、seabornに渡す前に通常の整数型に戻す
+            monthly_times = monthly_times.astype({'distance': 'int64', 'month': 'int64'})
             
-            for i, dist in enumerate(common_distances):
-                plt.subplot(len(common_distances), 1, i+1)
-                
-                dist_data = races_df[races_df['distance'] == dist]
-                if len(dist_data) > 0:  # データが存在する場合のみプロット
-                    monthly_times = dist_data.groupby('month')['タイム_秒'].mean()
-                    
-                    monthly_times.plot(kind='line', marker='o')
-                    plt.title(f'{dist}mレースの月別平均タイム')
-                    plt.xlabel('月')
-                    plt.ylabel('平均タイム (秒)')
-                    plt.xticks(range(1, 13))
-                    plt.grid(True, linestyle='--', alpha=0.7)
-            
-            plt.tight_layout()
-            plt.savefig(f'{output_dir}/monthly_average_times.png')
-            plt.close()
+            if len(monthly_times) > 0:  # データが存在する場合のみプロット
+                g = sns.relplot(
+                    data=monthly_times, x='month', y='タイム_秒', row='distance',
+                    kind='line', marker='o', height=10 / 3, aspect=4.5, facet_kws={'sharey': False}
+                )
+                g.set_titles('{row_name}mレースの月別平均タイム')
+                g.set_axis_labels('月', '平均タイム (秒)')
+                for ax in g.axes.flat:
+                    ax.set_xticks(range(1, 13))
+                    ax.grid(True, linestyle='--', alpha=0.7)
+                g.tight_layout()
+                g.savefig(f'{output_dir}/monthly_average_times.png')
+                plt.close(g.figure)
             
             # 月別の詳細データを保存
             monthly_stats = races_df.groupby(['month']).agg({
@@ -468,10 +511,39 @@ def analyze_track_weather_season(races_df):
     
     print("=== 馬場・天候・季節の影響分析が完了 ===")
 
+# 分析ごとの前回実行時の情報（入力・スクリプト・出力ファイル）の保存先
+meta_dir = f'{output_dir}/.meta'
+
+def run_analysis(func, input_files, *args):
+    """分析を実行する（入力ファイルとこのスクリプトが前回から変わっておらず、
+    前回の出力が揃っている場合は、グラフやCSVを作り直さずに省略する）"""
+    meta_path = f'{meta_dir}/{func.__name__}.json'
+    with open(__file__, 'rb') as f:
+        script_hash = hashlib.sha256(f.read()).hexdigest()
+    # しきい値（最低出走数など）はスクリプト内にあるので、スクリプトの内容が変われば作り直す
+    signature = {
+        'inputs': {path: os.path.getmtime(path) for path in input_files if path},
+        'script': script_hash
+    }
+    
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['signature'] == signature and all(os.path.exists(path) for path in meta['outputs']):
+            print(f"{func.__name__}: 入力が前回から変わっていないため、分析を省略します。")
+            return
+    
+    # 実行の前後で更新日時が変わったファイルを、この分析の出力として記録する
+    before = {path: os.path.getmtime(path) for path in glob.glob(f'{output_dir}/*')}
+    func(*args)
+    outputs = [path for path in glob.glob(f'{output_dir}/*') if before.get(path) != os.path.getmtime(path)]
+    
+    os.makedirs(meta_dir, exist_ok=True)
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'signature': signature, 'outputs': outputs}, f, ensure_ascii=False, indent=2)
+
 def main():
     """メイン実行関数"""
-    import glob
-    
     # 前処理済みデータの読み込み
     races_df, horse_info_df, horse_history_df = load_preprocessed_data()
     
@@ -479,17 +551,24 @@ def main():
         print("レースデータが利用できないため、分析を中止します。")
         return
     
+    # 集計用に列の型を変換
+    races_df = optimize_dtypes(races_df)
+    
+    # 各分析の入力ファイル（変わっていなければ前回の分析結果をそのまま使う）
+    race_file = _latest_file('cleaned_races_*.csv')
+    horse_info_file = _latest_file('cleaned_horse_info_*.csv')
+    
     # 1. レースデータの基本統計分析
-    analyze_race_statistics(races_df)
+    run_analysis(analyze_race_statistics, [race_file], races_df)
     
     # 2. 馬のパフォーマンス分析
-    analyze_horse_performance(races_df, horse_info_df)
+    run_analysis(analyze_horse_performance, [race_file, horse_info_file], races_df, horse_info_df)
     
     # 3. 騎手・調教師の分析
-    analyze_jockey_trainer_performance(races_df)
+    run_analysis(analyze_jockey_trainer_performance, [race_file], races_df)
     
     # 4. 馬場・天候・季節の影響分析
-    analyze_track_weather_season(races_df)
+    run_analysis(analyze_track_weather_season, [race_file], races_df)
     
     print(f"すべての分析結果は {output_dir} ディレクトリに保存されました。")
 
@@ -5,6 +5,7 @@ import seaborn as sns
 import os
 from datetime import datetime
 import glob
+from keiba_utils import read_csv_cached
 
 # 前処理済みデータが保存されているディレクトリ
 input_dir = 'preprocessed_data'
@@ -22,9 +23,9 @@ def load_preprocessed_data():
     horse_history_files = sorted(glob.glob(f'{input_dir}/cleaned_horse_history_*.csv'), reverse=True)
     
     # 最新のファイルを読み込む
-    races_df = pd.read_csv(race_files[0], encoding='utf-8-sig') if race_files else None
-    horse_info_df = pd.read_csv(horse_info_files[0], encoding='utf-8-sig') if horse_info_files else None
-    horse_history_df = pd.read_csv(horse_history_files[0], encoding='utf-8-sig') if horse_history_files else None
+    races_df = read_csv_cached(race_files[0]) if race_files else None
+    horse_info_df = read_csv_cached(horse_info_files[0]) if horse_info_files else None
+    horse_history_df = read_csv_cached(horse_history_files[0]) if horse_history_files else None
     
     if races_df is not None:
         print(f"レースデータ: {len(races_df)}行, {races_df.shape[1]}列")
@@ -435,9 +436,11 @@ def create_pedigree_features(horse_info_df, races_df):
                 how='left'
             ).dropna(subset=['father'])
             
-            father_track_stats = father_track_analysis.groupby(['father', 'track_condition']).agg(
-                races_count=('race_id', 'count'),
-                win_count=('着順_数値', lambda x: sum(x == 1)),
+            father_track_stats = father_track_analysis.assign(
+                is_win=father_track_analysis['着順_数値'] == 1
+            ).groupby(['father', 'track_condition']).agg(
+                races_count=('race_id', 'size'),
+                win_count=('is_win', 'sum'),
                 avg_rank=('着順_数値', 'mean')
             ).reset_index()
             
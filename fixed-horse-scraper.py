@@ -12,6 +12,8 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import argparse
 import re
+from concurrent.futures import ThreadPoolExecutor
+from keiba_utils import cells_to_dataframe
 
 # ロギングの設定
 logging.basicConfig(
@@ -25,9 +27,24 @@ logger = logging.getLogger(__name__)
 OUTPUT_DIR = 'horse_data'
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# デバッグ用ディレクトリ
+# バッチ内で同時に取得する馬の数
+SCRAPE_WORKERS = 3
+
+# 馬IDと通算成績の正規表現（呼び出しごとにコンパイルしないようにモジュールで1回だけコンパイル）
+HORSE_ID_RE = re.compile(r'^\d{8,10}$')
+CAREER_RECORD_RE = re.compile(r'(\d+)戦(\d+)勝')
+
+# デバッグ用ディレクトリ（取得したHTMLの保存は --debug または KEIBA_DEBUG_HTML=1 の場合のみ）
 HORSE_DEBUG_DIR = f"{OUTPUT_DIR}/debug_html"
-os.makedirs(HORSE_DEBUG_DIR, exist_ok=True)
+DEBUG_HTML = os.environ.get("KEIBA_DEBUG_HTML") == "1"
+if DEBUG_HTML:
+    os.makedirs(HORSE_DEBUG_DIR, exist_ok=True)
+
+def save_debug_html(filename, content):
+    """取得したHTMLを受信したバイト列のままデバッグ用ディレクトリに保存する（デバッグ時のみ）"""
+    if DEBUG_HTML:
+        with open(f"{HORSE_DEBUG_DIR}/{filename}", 'wb') as f:
+            f.write(content)
 
 # セッション管理とリトライ処理の設定
 def create_session():
@@ -38,7 +55,8 @@ def create_session():
         backoff_factor=1,
         status_forcelist=[429, 500, 502, 503, 504]
     )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
+    # 同じホストへの接続を使い回せるようにコネクションプールを確保する
+    adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=retry_strategy)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     
@@ -59,11 +77,43 @@ def create_session():
     
     return session
 
+# すべてのリクエストで共有するセッション（get_session()で初回に作成）
+_SESSION = None
+
+def get_session():
+    """共有セッションを返す（keep-aliveで接続を使い回すため、セッションは1つだけ作る）"""
+    global _SESSION
+    if _SESSION is None:
+        _SESSION = create_session()
+    return _SESSION
+
+# 解析済みのテーブルからDataFrameを作成
+def table_to_dataframe(table):
+    """
+    BeautifulSoupのテーブル要素からDataFrameを作成する（HTMLを文字列に戻してpd.read_htmlで解析し直さない）
+    （pd.read_htmlと同様にセル内の空白を詰め、数値への変換はcells_to_dataframeで行う）
+    
+    Returns:
+        DataFrame: テーブルの内容（ヘッダー行またはデータ行がない場合はNone）
+    """
+    headers = None
+    rows = []
+    for tr in table.find_all('tr'):
+        cells = [' '.join(cell.get_text().split()) for cell in tr.find_all(['th', 'td'], recursive=False)]
+        if headers is None:
+            if tr.find('th', recursive=False):
+                headers = cells
+            continue
+        if tr.find('td', recursive=False):
+            rows.append(cells)
+    
+    return cells_to_dataframe(headers, rows)
+
 # 馬の基本情報を取得
 def scrape_horse_info(horse_id, session=None):
     """馬の基本情報をスクレイピングする関数"""
     if session is None:
-        session = create_session()
+        session = get_session()
     
     url = f"https://db.netkeiba.com/horse/{horse_id}"
     logger.info(f"Requesting horse info: {url}")
@@ -79,10 +129,9 @@ def scrape_horse_info(horse_id, session=None):
         html_content = response.content.decode("euc-jp", "ignore")
         
         # デバッグ用にHTMLを保存
-        with open(f"{HORSE_DEBUG_DIR}/horse_{horse_id}.html", 'w', encoding='utf-8') as f:
-            f.write(html_content)
+        save_debug_html(f"horse_{horse_id}.html", response.content)
         
-        soup = BeautifulSoup(html_content, 'html.parser')
+        soup = BeautifulSoup(html_content, 'lxml')
         
         # 馬の基本情報を抽出
         horse_info = {'horse_id': horse_id}
@@ -215,7 +264,7 @@ def scrape_horse_info(horse_id, session=None):
                             horse_info['career_summary'] = value
                             
                             # レース数・勝利数などを抽出
-                            match = re.search(r'(\d+)戦(\d+)勝', value)
+                            match = CAREER_RECORD_RE.search(value)
                             if match:
                                 horse_info['total_races'] = int(match.group(1))
                                 horse_info['total_wins'] = int(match.group(2))
@@ -235,7 +284,7 @@ def scrape_horse_info(horse_id, session=None):
 def scrape_horse_history(horse_id, session=None):
     """馬の出走履歴をスクレイピングする関数"""
     if session is None:
-        session = create_session()
+        session = get_session()
     
     url = f"https://db.netkeiba.com/horse/{horse_id}/result/"
     logger.info(f"Requesting horse history: {url}")
@@ -251,10 +300,9 @@ def scrape_horse_history(horse_id, session=None):
         html_content = response.content.decode("euc-jp", "ignore")
         
         # デバッグ用にHTMLを保存
-        with open(f"{HORSE_DEBUG_DIR}/horse_history_{horse_id}.html", 'w', encoding='utf-8') as f:
-            f.write(html_content)
+        save_debug_html(f"horse_history_{horse_id}.html", response.content)
             
-        soup = BeautifulSoup(html_content, 'html.parser')
+        soup = BeautifulSoup(html_content, 'lxml')
         
         # 出走履歴テーブル（複数のセレクタを試す）
         history_table = None
@@ -284,11 +332,10 @@ def scrape_horse_history(horse_id, session=None):
             logger.warning(f"No history table found for horse {horse_id}")
             return None
         
-        # pandasでテーブルを解析
+        # 解析済みのテーブルから直接DataFrameを作成
         try:
-            dfs = pd.read_html(str(history_table))
-            if dfs:
-                df = dfs[0]
+            df = table_to_dataframe(history_table)
+            if df is not None:
                 # 列名をクリーンアップ
                 df.columns = [col.strip() if isinstance(col, str) else col for col in df.columns]
                 df['horse_id'] = horse_id
@@ -327,7 +374,7 @@ def scrape_horse_history(horse_id, session=None):
 def scrape_horse_training(horse_id, session=None):
     """馬の調教情報をスクレイピングする関数"""
     if session is None:
-        session = create_session()
+        session = get_session()
     
     # 複数の調教情報URLを試す
     urls = [
@@ -349,10 +396,9 @@ def scrape_horse_training(horse_id, session=None):
             html_content = response.content.decode("euc-jp", "ignore")
             
             # デバッグ用にHTMLを保存
-            with open(f"{HORSE_DEBUG_DIR}/horse_training_{horse_id}_{url.split('/')[-2]}.html", 'w', encoding='utf-8') as f:
-                f.write(html_content)
+            save_debug_html(f"horse_training_{horse_id}_{url.split('/')[-2]}.html", response.content)
                 
-            soup = BeautifulSoup(html_content, 'html.parser')
+            soup = BeautifulSoup(html_content, 'lxml')
             
             # 調教テーブル（複数のセレクタを試す）
             training_table = None
@@ -372,11 +418,10 @@ def scrape_horse_training(horse_id, session=None):
                 logger.warning(f"No training table found for horse {horse_id} at {url}")
                 continue
             
-            # pandasでテーブルを解析
+            # 解析済みのテーブルから直接DataFrameを作成
             try:
-                dfs = pd.read_html(str(training_table))
-                if dfs:
-                    df = dfs[0]
+                df = table_to_dataframe(training_table)
+                if df is not None:
                     # 列名をクリーンアップ
                     df.columns = [col.strip() if isinstance(col, str) else col for col in df.columns]
                     df['horse_id'] = horse_id
@@ -418,6 +463,48 @@ def load_existing_horse_ids():
     logger.info(f"Total existing horse IDs loaded: {len(existing_horse_ids)}")
     return existing_horse_ids
 
+# 1頭分の情報を収集（スレッドから呼ばれる）
+def scrape_single_horse(horse_id, session, include_training=False, max_retries=2):
+    """1頭の基本情報・出走履歴・調教情報を取得する（取得できなかったものはNone）"""
+    # 馬の基本情報（リトライあり）
+    horse_info = None
+    retries = 0
+    while horse_info is None and retries < max_retries:
+        if retries > 0:
+            logger.info(f"Retrying horse info for {horse_id} (attempt {retries+1})")
+            # リトライの前に少し長めに待機
+            time.sleep(random.uniform(7, 15))
+        
+        horse_info = scrape_horse_info(horse_id, session)
+        retries += 1
+    
+    # サーバー負荷軽減
+    time.sleep(random.uniform(5, 10))
+    
+    # 馬の出走履歴（リトライあり）
+    horse_history = None
+    retries = 0
+    while horse_history is None and retries < max_retries:
+        if retries > 0:
+            logger.info(f"Retrying horse history for {horse_id} (attempt {retries+1})")
+            time.sleep(random.uniform(7, 15))
+        
+        horse_history = scrape_horse_history(horse_id, session)
+        retries += 1
+    
+    # サーバー負荷軽減
+    time.sleep(random.uniform(5, 10))
+    
+    # 調教情報（オプション）
+    horse_training = None
+    if include_training:
+        horse_training = scrape_horse_training(horse_id, session)
+        
+        # サーバー負荷軽減
+        time.sleep(random.uniform(5, 10))
+    
+    return horse_info, horse_history, horse_training
+
 # 複数の馬情報を収集
 def scrape_multiple_horses(horse_ids, include_training=False, batch_size=3, pause_between_batches=45, max_retries=2, skip_existing=False):
     """
@@ -434,7 +521,7 @@ def scrape_multiple_horses(horse_ids, include_training=False, batch_size=3, paus
     all_horse_info = []
     all_horse_history = []
     all_horse_training = []
-    session = create_session()
+    session = get_session()
     
     # 処理済みの馬IDを記録
     processed_horses = set()
@@ -448,78 +535,46 @@ def scrape_multiple_horses(horse_ids, include_training=False, batch_size=3, paus
     # スキップされた馬のカウント
     skipped_count = 0
     
-    # バッチ処理
-    for i in range(0, len(horse_ids), batch_size):
-        batch = horse_ids[i:i+batch_size]
-        logger.info(f"Processing horse batch {i//batch_size + 1}/{(len(horse_ids) + batch_size - 1)//batch_size}")
-        
-        for j, horse_id in enumerate(batch):
-            # 既に処理済みの馬またはDBに存在する馬をスキップ
-            if horse_id in processed_horses or (skip_existing and horse_id in existing_horse_ids):
-                if horse_id in existing_horse_ids:
-                    logger.info(f"Skipping existing horse in database {j+1}/{len(batch)}: {horse_id}")
-                    skipped_count += 1
-                else:
-                    logger.info(f"Skipping already processed horse {j+1}/{len(batch)}: {horse_id}")
-                continue
+    # バッチ処理（バッチ内の馬は共有セッションで並列に取得する）
+    with ThreadPoolExecutor(max_workers=SCRAPE_WORKERS) as executor:
+        for i in range(0, len(horse_ids), batch_size):
+            batch = horse_ids[i:i+batch_size]
+            logger.info(f"Processing horse batch {i//batch_size + 1}/{(len(horse_ids) + batch_size - 1)//batch_size}")
+            
+            pending = []
+            for j, horse_id in enumerate(batch):
+                # 既に処理済みの馬またはDBに存在する馬をスキップ
+                if horse_id in processed_horses or (skip_existing and horse_id in existing_horse_ids):
+                    if horse_id in existing_horse_ids:
+                        logger.info(f"Skipping existing horse in database {j+1}/{len(batch)}: {horse_id}")
+                        skipped_count += 1
+                    else:
+                        logger.info(f"Skipping already processed horse {j+1}/{len(batch)}: {horse_id}")
+                    continue
                 
-            logger.info(f"Scraping horse {j+1}/{len(batch)}: {horse_id}")
-            
-            # 馬の基本情報（リトライあり）
-            horse_info = None
-            retries = 0
-            while horse_info is None and retries < max_retries:
-                if retries > 0:
-                    logger.info(f"Retrying horse info for {horse_id} (attempt {retries+1})")
-                    # リトライの前に少し長めに待機
-                    time.sleep(random.uniform(7, 15))
-                
-                horse_info = scrape_horse_info(horse_id, session)
-                retries += 1
-            
-            if horse_info:
-                all_horse_info.append(horse_info)
-            
-            # サーバー負荷軽減
-            time.sleep(random.uniform(5, 10))
-            
-            # 馬の出走履歴（リトライあり）
-            horse_history = None
-            retries = 0
-            while horse_history is None and retries < max_retries:
-                if retries > 0:
-                    logger.info(f"Retrying horse history for {horse_id} (attempt {retries+1})")
-                    time.sleep(random.uniform(7, 15))
-                
-                horse_history = scrape_horse_history(horse_id, session)
-                retries += 1
-            
-            if horse_history is not None:
-                all_horse_history.append(horse_history)
-            
-            # サーバー負荷軽減
-            time.sleep(random.uniform(5, 10))
-            
-            # 調教情報（オプション）
-            if include_training:
-                horse_training = scrape_horse_training(horse_id, session)
+                logger.info(f"Scraping horse {j+1}/{len(batch)}: {horse_id}")
+                # 同じバッチ内の重複も一度だけ取得する
+                processed_horses.add(horse_id)
+                pending.append(horse_id)
+            
+            # 結果は馬IDの順に受け取る
+            scraped = executor.map(lambda horse_id: scrape_single_horse(horse_id, session, include_training, max_retries), pending)
+            for horse_info, horse_history, horse_training in scraped:
+                if horse_info:
+                    all_horse_info.append(horse_info)
+                if horse_history is not None:
+                    all_horse_history.append(horse_history)
                 if horse_training is not None:
                     all_horse_training.append(horse_training)
-                
-                # サーバー負荷軽減
-                time.sleep(random.uniform(5, 10))
             
-            # 処理済みとしてマーク
-            processed_horses.add(horse_id)
-        
-        # 中間結果の保存
-        if (i + batch_size) % (batch_size * 3) == 0:
-            save_intermediate_horse_results(all_horse_info, all_horse_history, all_horse_training, i)
-        
-        # バッチ間の待機（より長めに）
-        if i + batch_size < len(horse_ids):
-            logger.info(f"Pausing for {pause_between_batches} seconds between batches")
-            time.sleep(pause_between_batches)
+            # 中間結果の保存
+            if (i + batch_size) % (batch_size * 3) == 0:
+                save_intermediate_horse_results(all_horse_info, all_horse_history, all_horse_training, i)
+            
+            # バッチ間の待機（より長めに）
+            if i + batch_size < len(horse_ids):
+                logger.info(f"Pausing for {pause_between_batches} seconds between batches")
+                time.sleep(pause_between_batches)
     
     # スキップされた馬の数を表示
     if skip_existing:
@@ -663,7 +718,7 @@ def extract_horse_ids_from_file(file_path):
                 if 'id' in col.lower() or 'horse' in col.lower():
                     values = df[col].dropna().astype(str).tolist()
                     # 典型的な馬IDのパターン（数字8-10桁）
-                    potential_ids = [val for val in values if re.match(r'^\d{8,10}$', val)]
+                    potential_ids = [val for val in values if HORSE_ID_RE.match(val)]
                     if potential_ids:
                         logger.info(f"Extracted {len(potential_ids)} potential horse IDs from column '{col}' in CSV file {file_path}")
                         return potential_ids
@@ -688,7 +743,7 @@ def extract_horse_ids_from_file(file_path):
 def collect_recent_active_horses(years=[2022, 2023], session=None):
     """最近の活躍馬のIDを収集する関数（改良版）"""
     if session is None:
-        session = create_session()
+        session = get_session()
     
     horse_ids = set()
     
@@ -705,10 +760,9 @@ def collect_recent_active_horses(years=[2022, 2023], session=None):
                 html_content = response.content.decode("euc-jp", "ignore")
                 
                 # デバッグ用にHTMLを保存
-                with open(f"{HORSE_DEBUG_DIR}/grade_races_{year}.html", 'w', encoding='utf-8') as f:
-                    f.write(html_content)
+                save_debug_html(f"grade_races_{year}.html", response.content)
                 
-                soup = BeautifulSoup(html_content, 'html.parser')
+                soup = BeautifulSoup(html_content, 'lxml')
                 
                 # 勝ち馬のリンクを抽出
                 winner_links = soup.select('td.win a[href*="/horse/"]')
@@ -748,10 +802,9 @@ def collect_recent_active_horses(years=[2022, 2023], session=None):
                 html_content = response.content.decode("euc-jp", "ignore")
                 
                 # デバッグ用にHTMLを保存
-                with open(f"{HORSE_DEBUG_DIR}/ranking_{url.split('=')[-1] if '=' in url else 'main'}.html", 'w', encoding='utf-8') as f:
-                    f.write(html_content)
+                save_debug_html(f"ranking_{url.split('=')[-1] if '=' in url else 'main'}.html", response.content)
                 
-                soup = BeautifulSoup(html_content, 'html.parser')
+                soup = BeautifulSoup(html_content, 'lxml')
                 
                 # 馬のリンクを抽出
                 horse_links = soup.select('a[href*="/horse/"]')
@@ -762,7 +815,7 @@ def collect_recent_active_horses(years=[2022, 2023], session=None):
                         try:
                             horse_id = href.split('/horse/')[1].rstrip('/')
                             # 数値のみの8-10桁のIDのみを対象
-                            if re.match(r'^\d{8,10}$', horse_id):
+                            if HORSE_ID_RE.match(horse_id):
                                 horse_ids.add(horse_id)
                         except:
                             continue
@@ -801,12 +854,19 @@ def parse_args():
                         help='Limit number of horses to collect (0 for all)')
     parser.add_argument('--skip-existing', action='store_true',
                         help='Skip horses that already exist in horse_data/horse_info_*.csv files')
+    parser.add_argument('--debug', action='store_true',
+                        help='Save fetched horse HTML to the debug directory')
     
     return parser.parse_args()
 
 # メイン実行関数
 def main():
+    global DEBUG_HTML
     args = parse_args()
+    
+    if args.debug:
+        DEBUG_HTML = True
+        os.makedirs(HORSE_DEBUG_DIR, exist_ok=True)
     horse_ids = []
     
     # 馬IDの収集元
@@ -0,0 +1,84 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+# 複数のスクリプトで共通して使う処理
+
+# 前処理済みCSVのキャッシュの保存先（Parquet形式、元のCSVが更新されていれば作り直す）
+CLEANED_CACHE_DIR = 'preprocessed_data/.cache/cleaned'
+
+def read_csv_cached(csv_path, columns=None):
+    """前処理済みCSVを読み込む（2回目以降はParquetキャッシュから読み込む）
+    columnsを指定した場合は、そのうち存在する列だけを読み込む"""
+    cache_path = f'{CLEANED_CACHE_DIR}/{os.path.splitext(os.path.basename(csv_path))[0]}.parquet'
+    if os.path.exists(cache_path) and os.path.getmtime(csv_path) <= os.path.getmtime(cache_path):
+        if columns is not None:
+            # Parquetは列単位で読めるので、使わない列はディスクから読み込まない
+            names = pq.read_schema(cache_path).names
+            columns = [col for col in columns if col in names]
+        return pd.read_parquet(cache_path, columns=columns)
+
+    df = pd.read_csv(csv_path, encoding='utf-8-sig')
+    try:
+        # 書き込み途中で中断しても壊れたキャッシュが残らないように、一時ファイルから置き換える
+        os.makedirs(CLEANED_CACHE_DIR, exist_ok=True)
+        df.to_parquet(f'{cache_path}.tmp', compression='zstd')
+        os.replace(f'{cache_path}.tmp', cache_path)
+    except Exception as e:
+        # 型が混在した列などでParquetに保存できない場合は、キャッシュせずにCSVの内容を使う
+        print(f"キャッシュを作成できませんでした: {csv_path} ({e})")
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+    return df
+
+def cells_to_dataframe(headers, rows, text_columns=()):
+    """
+    テーブルから取り出したセルの文字列からDataFrameを作成する
+    （pd.read_htmlと同様に、空のセルは欠損値に、数値だけの列は数値型にする。
+    　桁区切りのカンマはpd.read_htmlのthousands=','と同様に取り除いてから数値にする）
+    
+    Args:
+        headers: ヘッダー行のセルの文字列
+        rows: データ行ごとのセルの文字列
+        text_columns: 数値型に変換せず文字列のまま残す列名
+    
+    Returns:
+        DataFrame: テーブルの内容（ヘッダー行またはデータ行がない場合はNone）
+    """
+    if not headers or not rows:
+        return None
+    
+    # 列数がヘッダーと異なる行はヘッダーに合わせる
+    width = len(headers)
+    rows = [row[:width] + [''] * (width - len(row)) for row in rows]
+    df = pd.DataFrame(rows, columns=headers).replace('', None)
+    
+    for col in df.columns:
+        if col in text_columns:
+            continue
+        # 賞金の「13,000.0」のような桁区切りのカンマを取り除く
+        numeric = pd.to_numeric(df[col].str.replace(',', '', regex=False), errors='coerce')
+        if numeric.notna().sum() == df[col].notna().sum():
+            df[col] = numeric
+    
+    return df
+
+def write_csv(df, path):
+    """DataFrameをpyarrowのCSVライターで書き出す（Excelで開けるようにBOM付きUTF-8で保存）"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # pyarrowは日時を「2023-04-01 00:00:00.000000」と書き出すので、pandasのto_csvと同じ形式になるように
+    # 時刻のない列（race_date、birth_dateなど）は日付だけ、秒未満のない列は秒までの型にしてから書き出す
+    for i, name in enumerate(table.column_names):
+        if not pa.types.is_timestamp(table.field(i).type) or table.field(i).type.tz is not None:
+            continue
+        values = df[name].dropna()
+        if (values == values.dt.normalize()).all():
+            table = table.set_column(i, name, table.column(i).cast(pa.date32()))
+        elif (values == values.dt.floor('s')).all():
+            table = table.set_column(i, name, table.column(i).cast(pa.timestamp('s')))
+    with open(path, 'wb') as f:
+        f.write('\ufeff'.encode('utf-8'))
+        pa_csv.write_csv(table, f)
@@ -0,0 +1,39 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+# スクリプトはリポジトリ直下にあり、ファイル名にハイフンを含むものもあるので、パスを指定して読み込む
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def load_script(filename):
+    """リポジトリ直下のスクリプトをモジュールとして読み込む（読み込み時に作られるディレクトリやログは現在のディレクトリに置かれる）"""
+    name = os.path.splitext(filename)[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """一時ディレクトリを現在のディレクトリにする（スクリプトが作る出力・キャッシュをリポジトリに残さない）"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def data_preparation(workdir):
+    return load_script('data_preparation.py')
+
+@pytest.fixture
+def race_scraper(workdir):
+    return load_script('direct-race-scraper.py')
+
+@pytest.fixture
+def horse_scraper(workdir):
+    return load_script('fixed-horse-scraper.py')
+
+@pytest.fixture
+def exploratory_analysis(workdir):
+    return load_script('exploratory_analysis.py')
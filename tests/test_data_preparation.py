@@ -0,0 +1,103 @@
+import os
+
+import pandas as pd
+
+
+def _write_race_csv(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame({'race_id': [f'2023050101{i:02d}' for i in range(1, rows + 1)]}).to_csv(path, index=False)
+
+
+def test_disk_cache_reuses_result_until_inputs_change(data_preparation):
+    _write_race_csv('keiba_data/races_2023_20230101_000000.csv', 3)
+    calls = []
+
+    @data_preparation.disk_cache
+    def integrate(limit=None):
+        calls.append(limit)
+        df = pd.read_csv('keiba_data/races_2023_20230101_000000.csv', dtype=str)
+        return df.head(limit) if limit else df, None
+
+    first = integrate()
+    second = integrate()
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(second[0], first[0], check_dtype=False)
+    assert second[1] is None
+
+    # 引数が異なる呼び出しは別の結果としてキャッシュする
+    assert len(integrate(limit=2)[0]) == 2
+    assert len(calls) == 2
+
+    # 入力ファイルが更新されたら作り直す
+    path = 'keiba_data/races_2023_20230101_000000.csv'
+    _write_race_csv(path, 5)
+    os.utime(path, (os.path.getmtime(path) + 10,) * 2)
+    assert len(integrate()[0]) == 5
+    assert len(calls) == 3
+
+
+def test_disk_cache_key_depends_on_function_source(data_preparation):
+    def integrate():
+        return 1
+
+    def other():
+        return 2
+
+    key = data_preparation._input_key(integrate, (), {})
+    assert key == data_preparation._input_key(integrate, (), {})
+    assert key != data_preparation._input_key(other, (), {})
+    assert key != data_preparation._input_key(integrate, (1,), {})
+
+
+def test_write_csv_matches_pandas_dates(data_preparation, workdir):
+    df = pd.DataFrame({
+        'race_id': ['202305010101', '202305010102', '202305010103'],
+        'race_date': pd.to_datetime(['2023-04-01', None, '2023-04-02']),
+        'updated_at': pd.to_datetime(['2023-04-01 12:30:00', '2023-04-01 12:31:05', None]),
+        'measured_at': pd.to_datetime(['2023-04-01 12:30:00.250', None, None]),
+        'distance': [1600, 2000, 1200],
+        'タイム_秒': [90.4, None, 72.1],
+    })
+    pyarrow_path = workdir / 'pyarrow.csv'
+    pandas_path = workdir / 'pandas.csv'
+    data_preparation.write_csv(df, str(pyarrow_path))
+    df.to_csv(pandas_path, index=False, encoding='utf-8-sig')
+
+    assert pyarrow_path.read_bytes().startswith('\ufeff'.encode('utf-8'))
+    written = pd.read_csv(pyarrow_path, encoding='utf-8-sig', dtype=str)
+    expected = pd.read_csv(pandas_path, encoding='utf-8-sig', dtype=str)
+    pd.testing.assert_frame_equal(written[['race_id', 'race_date', 'updated_at', 'distance', 'タイム_秒']],
+                                  expected[['race_id', 'race_date', 'updated_at', 'distance', 'タイム_秒']])
+    # 秒未満のある列は精度を落とさずに書き出す
+    assert pd.to_datetime(written['measured_at'])[0] == df['measured_at'][0]
+
+
+def _convert_time_to_seconds_per_value(time_str):
+    """1件ずつ変換していた以前の実装"""
+    if pd.isna(time_str):
+        return None
+    try:
+        if ':' in str(time_str):
+            minutes, seconds = str(time_str).split(':')
+            return float(minutes) * 60 + float(seconds)
+        return float(time_str)
+    except:
+        return None
+
+
+def test_convert_time_to_seconds_matches_per_value_conversion(data_preparation):
+    times = pd.Series(['1:23.4', '2:01.0', '59.8', None, '', '中止', '1:xx', '0:58.2'])
+    expected = times.map(_convert_time_to_seconds_per_value).astype(float)
+    result = data_preparation.convert_time_to_seconds(times).astype(float)
+    pd.testing.assert_series_equal(result, expected, check_names=False)
+
+    # すべて秒だけで記録されている場合
+    seconds_only = pd.Series(['59.8', '61.2'])
+    assert data_preparation.convert_time_to_seconds(seconds_only).astype(float).tolist() == [59.8, 61.2]
+
+
+def test_parse_japanese_date_matches_to_datetime(data_preparation):
+    dates = pd.Series(['2023年4月1日', '2023年12月31日', '2024年2月29日', None, '不明', '2023年13月1日'], index=range(10, 16))
+    expected = pd.to_datetime(dates, format='%Y年%m月%d日', errors='coerce')
+    result = data_preparation.parse_japanese_date(dates)
+    pd.testing.assert_series_equal(result, expected.astype('datetime64[ns]'), check_names=False)
@@ -0,0 +1,154 @@
+import io
+import os
+import zlib
+from contextlib import closing
+
+import lxml.html
+import pandas as pd
+import pytest
+
+
+def test_generate_race_ids_follows_skip_rules(race_scraper, monkeypatch):
+    # 1回: 3日間（各日12R・5R・12R）、2回: 1日間（8R）、3回以降はなし
+    race_counts = {(1, 1): 12, (1, 2): 5, (1, 3): 12, (2, 1): 8}
+    requested = []
+
+    def is_valid_race(race_id, session=None, pages=None):
+        requested.append(race_id)
+        kai, day, race_num = int(race_id[6:8]), int(race_id[8:10]), int(race_id[10:12])
+        return race_num <= race_counts.get((kai, day), 0)
+
+    monkeypatch.setattr(race_scraper, 'is_valid_race', is_valid_race)
+    monkeypatch.setattr(race_scraper, 'get_session', lambda: None)
+    race_ids = race_scraper.generate_race_ids_efficiently(2023, ['05'])
+
+    assert race_ids == [f"202305{kai:02d}{day:02d}{race_num:02d}"
+                        for (kai, day), count in race_counts.items() for race_num in range(1, count + 1)]
+    assert len(requested) == len(set(requested))
+    # 存在しないレースが見つかった並びは、数件の先読みを超えて確認しない
+    wave = race_scraper.PROBE_WAVE_SIZE
+    assert not [race_id for race_id in requested if race_id[6:10] == '0102' and int(race_id[10:12]) > 6 + wave - 1]
+    assert not [race_id for race_id in requested if race_id[6:8] == '01' and int(race_id[8:10]) > 4 + wave - 1]
+    assert '202305030101' in requested
+    assert not [race_id for race_id in requested if int(race_id[6:8]) > 3]
+
+    # 2回目の実行では確認済みの結果を使い、サーバーに問い合わせない
+    requested.clear()
+    assert race_scraper.generate_race_ids_efficiently(2023, ['05']) == race_ids
+    assert requested == []
+
+
+def test_probed_pages_are_reused_and_removed(race_scraper, monkeypatch):
+    def is_valid_race(race_id, session=None, pages=None):
+        valid = race_id[6:10] == '0101' and int(race_id[10:12]) <= 3
+        if valid and pages is not None:
+            pages[race_id] = zlib.compress(race_id.encode('utf-8'))
+        return valid
+
+    received = {}
+
+    def scrape_race_results(race_id, session=None, page=None):
+        received[race_id] = page
+        return pd.DataFrame({'race_id': [race_id], 'horse_id': [f'{race_id}h']}), {'race_id': race_id}
+
+    monkeypatch.setattr(race_scraper, 'is_valid_race', is_valid_race)
+    monkeypatch.setattr(race_scraper, 'scrape_race_results', scrape_race_results)
+    monkeypatch.setattr(race_scraper.time, 'sleep', lambda seconds: None)
+    race_scraper.scrape_races_by_id_pattern_efficient(2023, places=['05'], batch_size=2, pause_between_batches=0)
+
+    # 存在確認で取得したページを結果の取得に使い、使い終わったページはデータベースから削除する
+    assert {race_id: zlib.decompress(page).decode('utf-8') for race_id, page in received.items()} == {
+        race_id: race_id for race_id in ['202305010101', '202305010102', '202305010103']}
+    with closing(race_scraper.open_probe_cache()) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM page").fetchone() == (0,)
+
+
+TABLE_HTML = """
+<table>
+  <tr><th>着 順</th><th>馬名</th><th>賞金 (万円)</th><th>タイム</th><th>通過</th></tr>
+  <tr><td>1</td><td> サンプルホース </td><td>13,000.0</td><td>1:33.5</td><td>1-1</td></tr>
+  <tr><td>2</td><td>テスト</td><td>5,200.0</td><td>1:33.7</td><td>2-2</td></tr>
+  <tr><td>中</td><td>ダミー</td><td></td><td></td><td>3-3</td></tr>
+</table>
+"""
+
+
+def _read_html(html):
+    return pd.read_html(io.StringIO(html), thousands=',')[0]
+
+
+def test_table_to_dataframe_matches_read_html(race_scraper):
+    table = lxml.html.fromstring(TABLE_HTML)
+    df = race_scraper.table_to_dataframe(table)
+    expected = _read_html(TABLE_HTML)
+
+    assert df.columns.tolist() == expected.columns.tolist()
+    assert df['賞金 (万円)'].tolist()[:2] == [13000.0, 5200.0]
+    for col in df.columns:
+        assert df[col].dtype.kind == expected[col].dtype.kind, col
+        assert df[col].isna().tolist() == expected[col].isna().tolist(), col
+        assert df[col].dropna().astype(str).tolist() == expected[col].dropna().astype(str).tolist(), col
+
+
+def test_table_to_dataframe_keeps_text_columns(race_scraper):
+    html = '<table><tr><th>着順</th><th>馬体重</th></tr><tr><td>1</td><td>480</td></tr></table>'
+    df = race_scraper.table_to_dataframe(lxml.html.fromstring(html), text_columns=['馬体重'])
+    assert df['着順'].tolist() == [1]
+    assert df['馬体重'].tolist() == ['480']
+    assert race_scraper.table_to_dataframe(lxml.html.fromstring('<table><tr><th>着順</th></tr></table>')) is None
+
+
+RACE_IDS = [f"2023050101{race_num:02d}" for race_num in range(1, 13)]
+
+
+class Interrupted(BaseException):
+    """実行の中断（Ctrl+Cなど）の代わり"""
+
+
+def _run_scraper(race_scraper, monkeypatch, fetched, interrupt_at=None):
+    def scrape_race_results(race_id, session=None, page=None):
+        if race_id == interrupt_at:
+            raise Interrupted
+        fetched.append(race_id)
+        return pd.DataFrame({'race_id': [race_id], 'horse_id': [f'{race_id}h']}), {'race_id': race_id}
+
+    monkeypatch.setattr(race_scraper, 'generate_race_ids_efficiently', lambda *args, **kwargs: RACE_IDS)
+    monkeypatch.setattr(race_scraper, 'scrape_race_results', scrape_race_results)
+    monkeypatch.setattr(race_scraper.time, 'sleep', lambda seconds: None)
+    return race_scraper.scrape_races_by_id_pattern_efficient(2023, places=['05'], batch_size=3, pause_between_batches=0)
+
+
+def test_resume_skips_completed_races(race_scraper, monkeypatch):
+    fetched = []
+    with pytest.raises(Interrupted):
+        _run_scraper(race_scraper, monkeypatch, fetched, interrupt_at=RACE_IDS[7])
+    assert os.path.exists(race_scraper.checkpoint_path(2023, ['05']))
+
+    # 進捗ファイルを消してもチェックポイントから再開できる
+    for name in os.listdir(race_scraper.OUTPUT_DIR):
+        if name.startswith('race_scraping_progress'):
+            os.remove(os.path.join(race_scraper.OUTPUT_DIR, name))
+    fetched.clear()
+    races_df, race_infos, horse_ids = _run_scraper(race_scraper, monkeypatch, fetched)
+
+    # 中断したバッチ（7R～9R）から取得し直す
+    assert fetched == RACE_IDS[6:]
+    assert races_df['race_id'].tolist() == RACE_IDS
+    assert [info['race_id'] for info in race_infos] == RACE_IDS
+    assert len(horse_ids) == len(RACE_IDS)
+    assert not os.path.exists(race_scraper.checkpoint_path(2023, ['05']))
+
+
+def test_checkpoint_with_other_settings_is_ignored(race_scraper, monkeypatch):
+    assert race_scraper.checkpoint_config_hash(2023, ['05', '01']) == race_scraper.checkpoint_config_hash(2023, ['01', '05'])
+    assert race_scraper.checkpoint_config_hash(2023, ['05']) != race_scraper.checkpoint_config_hash(2024, ['05'])
+
+    checkpoint = {'config_hash': race_scraper.checkpoint_config_hash(2023, ['05']), 'completed_race_ids': RACE_IDS[:3]}
+    race_scraper.save_checkpoint(2023, ['05'], checkpoint)
+    assert race_scraper.load_checkpoint(2023, ['05']) == checkpoint
+
+    # 保存形式のバージョンが変わったチェックポイントは、--force_resumeを指定しない限り使わない
+    monkeypatch.setattr(race_scraper, 'SCRAPER_VERSION', race_scraper.SCRAPER_VERSION + 1)
+    assert not race_scraper.checkpoint_is_compatible(2023, ['05'])
+    assert race_scraper.load_checkpoint(2023, ['05']) is None
+    assert race_scraper.load_checkpoint(2023, ['05'], force_resume=True) == checkpoint
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def _sample_races():
+    rng = np.random.default_rng(0)
+    n = 500
+    rank = rng.integers(1, 17, n).astype(float)
+    rank[rng.random(n) < 0.1] = np.nan  # 中止・除外などで着順がない出走
+    jockeys = rng.choice(['騎手A', '騎手B', '騎手C', '騎手D', None], n, p=[0.3, 0.3, 0.2, 0.15, 0.05])
+    return pd.DataFrame({
+        'race_id': [f'2023050101{i % 12 + 1:02d}' for i in range(n)],
+        'horse_id': [f'2019100{i:03d}' for i in rng.integers(0, 40, n)],
+        '騎手': jockeys,
+        'trainer': rng.choice(['調教師A', '調教師B', '調教師C'], n),
+        '着順_数値': rank,
+    })
+
+
+@pytest.mark.parametrize('key, count_col', [('horse_id', 'races_count'), ('騎手', 'rides_count'), ('trainer', 'horses_count')])
+def test_rate_kernel_matches_groupby(exploratory_analysis, monkeypatch, key, count_col):
+    races_df = exploratory_analysis.add_result_flags(exploratory_analysis.optimize_dtypes(_sample_races()))
+
+    monkeypatch.setattr(exploratory_analysis, 'njit', None)
+    expected = exploratory_analysis._rate_table(races_df, key, 5, count_col=count_col)
+    # Numbaがなくても集計カーネルの経路を通るように、JITせずにPythonの関数のまま実行する
+    monkeypatch.setattr(exploratory_analysis, 'njit', lambda func: func)
+    result = exploratory_analysis._rate_table(races_df, key, 5, count_col=count_col)
+
+    for got, want in zip(result, expected):
+        pd.testing.assert_frame_equal(got.reset_index(drop=True), want.reset_index(drop=True), check_dtype=False)
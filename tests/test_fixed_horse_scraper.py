@@ -0,0 +1,33 @@
+import io
+
+import lxml.html
+import pandas as pd
+from bs4 import BeautifulSoup
+
+HISTORY_HTML = """
+<table class="db_h_race_results">
+  <tr><th>日付</th><th>開催</th><th>着 順</th><th>賞金</th><th>馬体重</th></tr>
+  <tr><td>2023/04/01</td><td> 1中山3 </td><td>1</td><td>1,500.0</td><td>480(+2)</td></tr>
+  <tr><td>2023/03/01</td><td>2阪神1</td><td>中</td><td></td><td>478(0)</td></tr>
+  <tr><td>2023/02/01</td><td>1東京5</td><td>3</td><td>12,345.6</td><td>計不</td></tr>
+</table>
+"""
+
+
+def test_table_to_dataframe_matches_read_html(horse_scraper):
+    table = BeautifulSoup(HISTORY_HTML, 'lxml').find('table')
+    df = horse_scraper.table_to_dataframe(table)
+    expected = pd.read_html(io.StringIO(HISTORY_HTML), thousands=',')[0]
+
+    assert df.columns.tolist() == expected.columns.tolist()
+    assert df['賞金'].tolist()[::2] == [1500.0, 12345.6]
+    for col in df.columns:
+        assert df[col].dtype.kind == expected[col].dtype.kind, col
+        assert df[col].isna().tolist() == expected[col].isna().tolist(), col
+        assert df[col].dropna().astype(str).tolist() == expected[col].dropna().astype(str).tolist(), col
+
+
+def test_both_scrapers_convert_cells_alike(horse_scraper, race_scraper):
+    race_df = race_scraper.table_to_dataframe(lxml.html.fromstring(HISTORY_HTML))
+    horse_df = horse_scraper.table_to_dataframe(BeautifulSoup(HISTORY_HTML, 'lxml').find('table'))
+    pd.testing.assert_frame_equal(race_df, horse_df)